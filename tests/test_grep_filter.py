@@ -0,0 +1,44 @@
+# Tests for GrepFilter, the streaming filter behind --grep/-B/-A
+import os
+import unittest
+import importlib.util
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "SOCK-party.py")
+spec = importlib.util.spec_from_file_location("sock_party", SCRIPT)
+sock_party = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sock_party)
+
+LINES = [f"line {number}\n" for number in range(1, 11)]
+
+# Function to feed every line through a filter and collect what it shows
+def run_filter(grep, lines=LINES):
+    shown = []
+    for line in lines:
+        shown.extend(grep.feed(line))
+    return shown
+
+class GrepFilterTest(unittest.TestCase):
+    def test_shows_only_matching_lines(self):
+        self.assertEqual(run_filter(sock_party.GrepFilter(r"line [37]\b")), ["line 3\n", "line 7\n"])
+
+    def test_no_separator_without_context(self):
+        self.assertNotIn("--\n", run_filter(sock_party.GrepFilter(r"line (1|5|9)\b")))
+
+    def test_before_and_after_context(self):
+        shown = run_filter(sock_party.GrepFilter(r"line 5\b", before=2, after=1))
+        self.assertEqual(shown, ["line 3\n", "line 4\n", "line 5\n", "line 6\n"])
+
+    def test_separates_non_adjacent_groups(self):
+        shown = run_filter(sock_party.GrepFilter(r"line (2|8)\b", before=1, after=1))
+        self.assertEqual(shown, ["line 1\n", "line 2\n", "line 3\n", "--\n", "line 7\n", "line 8\n", "line 9\n"])
+
+    def test_overlapping_groups_share_lines(self):
+        shown = run_filter(sock_party.GrepFilter(r"line (4|6)\b", before=1, after=1))
+        self.assertEqual(shown, ["line 3\n", "line 4\n", "line 5\n", "line 6\n", "line 7\n"])
+
+    def test_invalid_regex_matches_literally(self):
+        lines = ["password(\n", "password\n", "(\n"]
+        self.assertEqual(run_filter(sock_party.GrepFilter("password("), lines), ["password(\n"])
+
+if __name__ == "__main__":
+    unittest.main()
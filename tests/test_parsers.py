@@ -0,0 +1,161 @@
+# Tests for the nxc output parsers behind findings.db and --query, using captured nxc output
+import os
+import unittest
+import importlib.util
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "SOCK-party.py")
+spec = importlib.util.spec_from_file_location("sock_party", SCRIPT)
+sock_party = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sock_party)
+
+PREFIX = "SMB         10.0.0.5        445    WS01             "
+
+# Function to turn captured nxc messages into output lines for one host
+def nxc_output(*messages):
+    return [f"{PREFIX}{message}\n" for message in messages]
+
+LOGIN = (
+    "[*] Windows 10 / Server 2019 Build 19041 x64 (name:WS01) (domain:corp.local) (signing:False) (SMBv1:False)",
+    "[+] corp.local\\admin: (Pwn3d!)",
+)
+
+SHARES_OUTPUT = nxc_output(
+    *LOGIN,
+    "[*] Enumerated shares",
+    "Share           Permissions     Remark",
+    "-----           -----------     ------",
+    "ADMIN$          READ,WRITE      Remote Admin",
+    "C$              READ,WRITE      Default share",
+    "IPC$            READ            Remote IPC",
+    "Finance Data    READ,WRITE      Quarterly reports",
+    "Scans           READ            ",
+    "Secret                          ",
+    "Public Docs                     Shared documents",
+)
+
+LOCAL_ADMINS_OUTPUT = nxc_output(
+    *LOGIN,
+    "[+] Executed command via wmiexec",
+    "Alias name     Administrators",
+    "Comment        Administrators have complete and unrestricted access to the computer/domain",
+    "",
+    "Members",
+    "",
+    "-------------------------------------------------------------------------------",
+    "Administrator",
+    "CORP\\Domain Admins",
+    "CORP\\helpdesk",
+    "The command completed successfully.",
+)
+
+SESSIONS_OUTPUT = nxc_output(
+    *LOGIN,
+    "[+] Enumerated logged_on users",
+    "CORP\\alice                     logon_server: DC01",
+    "WS01\\Administrator             logon_server: WS01",
+)
+
+LOCAL_USERS_TABLE_OUTPUT = nxc_output(
+    *LOGIN,
+    "[*] Trying to dump local users with SAMRPC protocol",
+    "-Username-                    -Last PW Set-       -BadPW- -Description-",
+    "Administrator                 <never>             0       Built-in account for administering the computer/domain",
+    "backup_svc                    2024-01-01 10:00:00 0",
+    "[*] Enumerated 2 local users: WS01",
+)
+
+LOCAL_USERS_LEGACY_OUTPUT = nxc_output(
+    *LOGIN,
+    "[+] Enumerated domain user(s)",
+    "WS01\\Administrator             badpwdcount: 0 desc: Built-in account for administering the computer/domain",
+    "WS01\\Guest                     badpwdcount: 0 desc: Built-in account for guest access to the computer/domain",
+)
+
+SPIDER_OUTPUT = nxc_output(
+    *LOGIN,
+    "[*] Started spidering",
+    "[*] Spidering .",
+    "//10.0.0.5/Finance Data/IT/passwords.xlsx [lastm:'2024-03-01 09:12' size:18211]",
+    "//10.0.0.5/Finance Data/IT/old passwords [dir]",
+    "//10.0.0.5/Finance Data/IT/old passwords/pw backup.txt [lastm:'2023-12-24 18:00' size:42]",
+    "//10.0.0.5/Finance Data/IT/passwords.kdbx [lastm:'2024-01-02 10:11' size:99999999]",
+    "[*] Done spidering (Completed in 3.2s)",
+)
+
+class NxcMessagesTest(unittest.TestCase):
+    def test_strips_prefix_colors_and_untagged_lines(self):
+        lines = [
+            "[proxychains] Strict chain  ...  127.0.0.1:1080  ...  10.0.0.5:445  ...  OK\n",
+            f"{PREFIX}\x1b[34;1m[*]\x1b[0m Enumerated shares   \n",
+        ]
+        self.assertEqual(list(sock_party.nxc_messages(lines)), ["[*] Enumerated shares"])
+
+class ParseSharesTest(unittest.TestCase):
+    def test_parses_share_table(self):
+        self.assertEqual(list(sock_party.parse_shares(SHARES_OUTPUT)), [
+            ("ADMIN$", "READ,WRITE", "Remote Admin", 1),
+            ("C$", "READ,WRITE", "Default share", 1),
+            ("IPC$", "READ", "Remote IPC", 1),
+            ("Finance Data", "READ,WRITE", "Quarterly reports", 0),
+            ("Scans", "READ", "", 0),
+            ("Secret", "", "", 0),
+            ("Public Docs", "", "Shared documents", 0),
+        ])
+
+    def test_ignores_lines_before_the_table(self):
+        self.assertEqual(list(sock_party.parse_shares(nxc_output(*LOGIN, "[-] Error enumerating shares: STATUS_ACCESS_DENIED"))), [])
+
+class ParseLocalAdminsTest(unittest.TestCase):
+    def test_parses_members_between_separator_and_footer(self):
+        self.assertEqual(list(sock_party.parse_local_admins(LOCAL_ADMINS_OUTPUT)), [
+            ("Administrator",),
+            ("CORP\\Domain Admins",),
+            ("CORP\\helpdesk",),
+        ])
+
+class ParseSessionsTest(unittest.TestCase):
+    def test_parses_logged_on_users(self):
+        self.assertEqual(list(sock_party.parse_sessions(SESSIONS_OUTPUT)), [("CORP\\alice",), ("WS01\\Administrator",)])
+
+class ParseLocalUsersTest(unittest.TestCase):
+    def test_parses_table_format(self):
+        self.assertEqual(list(sock_party.parse_local_users(LOCAL_USERS_TABLE_OUTPUT)), [("Administrator",), ("backup_svc",)])
+
+    def test_parses_badpwdcount_format(self):
+        self.assertEqual(list(sock_party.parse_local_users(LOCAL_USERS_LEGACY_OUTPUT)), [("Administrator",), ("Guest",)])
+
+class ParseSpiderMatchesTest(unittest.TestCase):
+    def test_parses_files_and_skips_directories(self):
+        self.assertEqual(list(sock_party.parse_spider_matches(SPIDER_OUTPUT)), [
+            ("Finance Data", "IT/passwords.xlsx", 18211, "2024-03-01 09:12"),
+            ("Finance Data", "IT/old passwords/pw backup.txt", 42, "2023-12-24 18:00"),
+            ("Finance Data", "IT/passwords.kdbx", 99999999, "2024-01-02 10:11"),
+        ])
+
+class FindingsStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.findings = sock_party.FindingsStore(":memory:")
+
+    def tearDown(self):
+        self.findings.close()
+
+    def test_ingest_replaces_a_hosts_rows(self):
+        self.findings.ingest("List shares", "10.0.0.5", SHARES_OUTPUT)
+        self.findings.ingest("List shares", "10.0.0.5", SHARES_OUTPUT[:-2])
+        self.assertEqual(self.findings.readable_shares("10.0.0.5"), ["Finance Data", "Scans"])
+        self.assertEqual(len(self.findings.query("SELECT * FROM shares WHERE ip = ?", ("10.0.0.5",))), 5)
+
+    def test_writable_shares_query(self):
+        self.findings.ingest("List shares", "10.0.0.5", SHARES_OUTPUT)
+        _, sql, _ = sock_party.FINDINGS_QUERIES["writable-shares"]
+        self.assertEqual(self.findings.query(sql, ("%",)), [("10.0.0.5", "Finance Data", "READ,WRITE", "Quarterly reports")])
+
+    def test_spider_matches_merge_and_respect_max_size(self):
+        spider = {"pattern": "passw", "depth": 3, "max_size": 10, "content": False}
+        self.findings.ingest(sock_party.SPIDER_ACTION, "10.0.0.5", SPIDER_OUTPUT, spider)
+        self.findings.ingest(sock_party.SPIDER_ACTION, "10.0.0.5", SPIDER_OUTPUT, spider)
+        rows = self.findings.query("SELECT share, path FROM spider_matches ORDER BY path")
+        self.assertEqual(rows, [("Finance Data", "IT/old passwords/pw backup.txt"), ("Finance Data", "IT/passwords.xlsx")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+# Tests for load_playbook, which must reject a bad playbook before any step runs
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "SOCK-party.py")
+spec = importlib.util.spec_from_file_location("sock_party", SCRIPT)
+sock_party = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sock_party)
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+class LoadPlaybookTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    # Write a playbook to a temporary file and load it
+    def load(self, playbook, name="playbook.json"):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as file:
+            file.write(playbook if isinstance(playbook, str) else json.dumps(playbook))
+        return sock_party.load_playbook(path)
+
+    def assertRejected(self, playbook, message):
+        with self.assertRaises(ValueError) as raised:
+            self.load(playbook)
+        self.assertIn(message, str(raised.exception))
+
+    def test_defaults_and_conversions(self):
+        playbook = self.load({"interval": "30", "steps": [
+            {"action": "List shares"},
+            {"action": "List security events", "targets": ["10.0.0.0/24", "new"], "params": {"event_count": "5", "grep": "4624", "grep_before": "1"}},
+            {"action": sock_party.SPIDER_ACTION, "params": {"pattern": ["passw", "kdbx"], "max_size": 2.5, "content": "yes"}},
+        ]})
+        self.assertEqual(playbook["interval"], 30.0)
+        self.assertEqual(playbook["steps"][0]["targets"], "all")
+        self.assertEqual(playbook["steps"][0]["params"], {})
+        self.assertEqual(playbook["steps"][1]["params"], {"event_count": 5, "grep": "4624", "grep_before": 1})
+        self.assertEqual(playbook["steps"][2]["params"], {"pattern": "passw kdbx", "max_size": 2.5, "content": True})
+
+    def test_bare_list_is_the_steps(self):
+        playbook = self.load([{"action": "List shares"}])
+        self.assertEqual(playbook["steps"], [{"action": "List shares", "targets": "all", "params": {}}])
+        self.assertEqual(playbook["interval"], 0.0)
+
+    def test_rejects_missing_or_empty_steps(self):
+        self.assertRejected({}, "non-empty 'steps' list")
+        self.assertRejected({"steps": []}, "non-empty 'steps' list")
+
+    def test_rejects_unknown_action(self):
+        self.assertRejected([{"action": "Format C:"}], "step 1: 'action' must be one of")
+
+    def test_rejects_bad_target(self):
+        self.assertRejected([{"action": "List shares", "targets": "10.0.0.300"}], "step 1: target '10.0.0.300'")
+
+    def test_rejects_unknown_param(self):
+        self.assertRejected([{"action": "List shares", "params": {"depht": 2}}], "step 1: unknown params depht")
+
+    def test_rejects_bad_param_values(self):
+        cases = [
+            ({"grep_before": "two"}, "param 'grep_before' must be a whole number >= 0"),
+            ({"grep_after": -1}, "param 'grep_after' must be a whole number >= 0"),
+            ({"event_count": 0}, "param 'event_count' must be a whole number >= 1"),
+            ({"timeout": "soon"}, "param 'timeout' must be a number"),
+            ({"exec_method": "psexec"}, "param 'exec_method' must be one of: wmiexec"),
+            ({"refresh": "maybe"}, "param 'refresh' must be true or false"),
+            ({"grep": ""}, "param 'grep' must be a non-empty string"),
+        ]
+        for params, message in cases:
+            with self.subTest(params=params):
+                self.assertRejected([{"action": "List shares"}, {"action": "List shares", "params": params}], f"step 2: {message}")
+
+    def test_spider_needs_a_positive_max_size_and_a_pattern(self):
+        self.assertRejected([{"action": sock_party.SPIDER_ACTION}], f"step 1: '{sock_party.SPIDER_ACTION}' needs a 'pattern' param")
+        self.assertRejected([{"action": sock_party.SPIDER_ACTION, "params": {"pattern": "passw", "max_size": 0}}], "param 'max_size' must be a number greater than 0")
+
+    def test_rejects_bad_interval(self):
+        self.assertRejected({"interval": -5, "steps": [{"action": "List shares"}]}, "'interval' must be a number >= 0")
+
+    @unittest.skipIf(yaml is None, "PyYAML is not installed")
+    def test_loads_yaml(self):
+        playbook = self.load("steps:\n  - action: List shares\n    params:\n      refresh: yes\n", name="playbook.yml")
+        self.assertEqual(playbook["steps"][0]["params"], {"refresh": True})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# Tests for RelayPoller against a local stand-in for the ntlmrelayx /relays API
+import os
+import json
+import threading
+import unittest
+import importlib.util
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "SOCK-party.py")
+spec = importlib.util.spec_from_file_location("sock_party", SCRIPT)
+sock_party = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sock_party)
+
+RELAY_A = ["SMB", "10.0.0.1", "CORP/alice", "TRUE", "445"]
+RELAY_B = ["SMB", "10.0.0.2", "CORP/bob", "FALSE", "445"]
+RELAY_C = ["SMB", "10.0.0.3", "CORP/alice", "TRUE", "445"]
+
+# Class serving /ntlmrelayx/api/v1.0/relays from a list the test can change, or a 500 while failing
+class FakeRelayAPI:
+    def __init__(self, rows):
+        self.rows = rows
+        self.failing = False
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if api.failing:
+                    self.send_response(500)
+                    self.end_headers()
+                    return
+                body = json.dumps(api.rows).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/ntlmrelayx/api/v1.0/relays"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class RelayPollerTest(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeRelayAPI([RELAY_A, RELAY_B])
+        self.poller = sock_party.RelayPoller(self.api.url, timeout=5, initial=[RELAY_A, RELAY_B])
+
+    def tearDown(self):
+        self.poller.stop()
+        self.api.close()
+
+    def test_unchanged_relays_publish_nothing(self):
+        self.poller.poll_once()
+        self.assertEqual(self.poller.drain(), ([], []))
+        self.assertFalse(self.poller.failing)
+
+    def test_publishes_added_and_removed_relays(self):
+        self.api.rows = [RELAY_A, RELAY_C]
+        self.poller.poll_once()
+        self.assertEqual(self.poller.drain(), ([RELAY_C], [RELAY_B]))
+        # Each change is published once
+        self.poller.poll_once()
+        self.assertEqual(self.poller.drain(), ([], []))
+
+    def test_drain_merges_changes_from_several_polls(self):
+        self.api.rows = [RELAY_A, RELAY_B, RELAY_C]
+        self.poller.poll_once()
+        self.api.rows = [RELAY_A, RELAY_C]
+        self.poller.poll_once()
+        self.assertEqual(self.poller.drain(), ([RELAY_C], [RELAY_B]))
+
+    def test_failing_api_keeps_last_known_relays(self):
+        self.api.failing = True
+        self.poller.poll_once()
+        self.assertTrue(self.poller.failing)
+        self.assertEqual(self.poller.drain(), ([], []))
+
+        # Once the API answers again only real differences are published
+        self.api.failing = False
+        self.api.rows = [RELAY_A, RELAY_B, RELAY_C]
+        self.poller.poll_once()
+        self.assertFalse(self.poller.failing)
+        self.assertEqual(self.poller.drain(), ([RELAY_C], []))
+
+    def test_unreachable_api_keeps_last_known_relays(self):
+        self.api.close()
+        self.poller.poll_once()
+        self.assertTrue(self.poller.failing)
+        self.assertEqual(self.poller.drain(), ([], []))
+
+    def test_changes_apply_to_relay_index(self):
+        relays = sock_party.RelayIndex([RELAY_A, RELAY_B])
+        self.api.rows = [RELAY_A, RELAY_C]
+        self.poller.poll_once()
+        added, removed = self.poller.drain()
+        relays.add(added)
+        relays.remove(removed)
+        self.assertEqual(sorted(relays.systems), ["10.0.0.1", "10.0.0.3"])
+        self.assertEqual(sorted(relays.admin_ips_by_user["CORP/alice"]), ["10.0.0.1", "10.0.0.3"])
+        self.assertNotIn("CORP/bob", relays.users)
+
+if __name__ == "__main__":
+    unittest.main()